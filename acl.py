@@ -0,0 +1,158 @@
+"""
+Module: acl.py
+Description: Compact interned representation of the records in an icacls export
+
+Author: Andrew Collings
+Created: 2026-10-18
+Updated: 2026-10-18
+License: MIT
+"""
+
+import array
+import bisect
+import collections
+import re
+
+DOMAIN_SID_PREFIX = 'S-1-5-21-'
+SID_PATTERN = re.compile(r';;;(' + re.escape(DOMAIN_SID_PREFIX) + r'[0-9-]+)\)')
+
+def scan_sids(acl_lines):
+    # Domain SID occurrences in the DACL ACEs of a run of ACL lines. Each distinct ACL is scanned
+    # once with SID_PATTERN and its SIDs weighted by the records that carry it, so no ACEs are built.
+    counts = collections.Counter()
+    for acl, records in collections.Counter(acl_lines).items():
+        if acl:
+            for sid in SID_PATTERN.findall(acl.partition('S:')[0]):
+                counts[sid] += records
+    return counts
+
+class SidTable:
+    # Each distinct SID string is stored once and referred to by its integer ID
+    __slots__ = ('sids', 'ids', 'domain')
+
+    def __init__(self):
+        self.sids = []
+        self.ids = {}
+        self.domain = bytearray()
+
+    def __len__(self):
+        return len(self.sids)
+
+    def intern(self, sid):
+        sid_id = self.ids.get(sid)
+        if sid_id is None:
+            sid_id = self.ids[sid] = len(self.sids)
+            self.sids.append(sid)
+            self.domain.append(sid.startswith(DOMAIN_SID_PREFIX))
+        return sid_id
+
+    def domain_sids(self):
+        return {sid for sid, domain in zip(self.sids, self.domain) if domain}
+
+    def counts(self, sid_counts):
+        # Counter of domain SIDs from occurrence counts indexed by SID ID
+        return collections.Counter({sid: count for sid, domain, count in zip(self.sids, self.domain, sid_counts) if domain and count})
+
+    def translate(self, sid_pairs):
+        # Target SID for every SID ID, or None if the SID is not being paired
+        return [sid_pairs.get(sid) if domain else None for sid, domain in zip(self.sids, self.domain)]
+
+class SidMap:
+    # Read-only template to target SID map held as two sorted tuples. It pickles far smaller
+    # than a dict, so it is cheap to hand to every worker once when the pool starts.
+    __slots__ = ('keys', 'values')
+
+    def __init__(self, sid_pairs):
+        items = sorted(sid_pairs.items())
+        self.keys = tuple(key for key, value in items)
+        self.values = tuple(value for key, value in items)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, sid):
+        return self.get(sid) is not None
+
+    def get(self, sid, default=None):
+        i = bisect.bisect_left(self.keys, sid)
+        if i < len(self.keys) and self.keys[i] == sid:
+            return self.values[i]
+        return default
+
+    def items(self):
+        return zip(self.keys, self.values)
+
+class Chunk:
+    # Files only hold a path and an ACL ID. ACLs are stored once per distinct text as a
+    # tuple of ACE IDs, and ACEs once per distinct text as a head plus a SID ID.
+    __slots__ = ('paths', 'acl_ids', 'acl_texts', 'acl_prefixes', 'acl_aces', 'acl_sacls', 'acl_index',
+                 'ace_heads', 'ace_sids', 'ace_texts', 'ace_index', 'sids')
+
+    def __init__(self):
+        self.paths = []
+        self.acl_ids = array.array('I')
+        self.acl_texts = []
+        self.acl_prefixes = []
+        self.acl_aces = []
+        self.acl_sacls = []
+        self.acl_index = {}
+        self.ace_heads = []
+        self.ace_sids = array.array('I')
+        self.ace_texts = []
+        self.ace_index = {}
+        self.sids = SidTable()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, path, acl):
+        acl_id = self.acl_index.get(acl)
+        if acl_id is None:
+            acl_id = self.add_acl(acl)
+        self.paths.append(path)
+        self.acl_ids.append(acl_id)
+
+    def add_acl(self, acl):
+        sacl = ''
+        dacl = acl
+        if 'S:' in acl:
+            sacl_split = acl.split('S:')
+            sacl = 'S:' + sacl_split[1]
+            dacl = sacl_split[0]
+        fperms = dacl.split('(')
+        acl_id = self.acl_index[acl] = len(self.acl_texts)
+        self.acl_texts.append(acl)
+        self.acl_prefixes.append(fperms[0])
+        self.acl_aces.append(tuple(self.add_ace('(' + i) for i in fperms[1:]))
+        self.acl_sacls.append(sacl)
+        return acl_id
+
+    def add_ace(self, ace):
+        ace_id = self.ace_index.get(ace)
+        if ace_id is None:
+            head, _, rest = ace.partition(';;;')
+            ace_id = self.ace_index[ace] = len(self.ace_texts)
+            self.ace_heads.append(head)
+            self.ace_sids.append(self.sids.intern(rest[:-1]))
+            self.ace_texts.append(ace)
+        return ace_id
+
+    def sid_counts(self):
+        # Domain SID occurrences over every record, worked out once per distinct ACL
+        sid_counts = [0] * len(self.sids)
+        for acl_id, records in collections.Counter(self.acl_ids).items():
+            for ace_id in self.acl_aces[acl_id]:
+                sid_counts[self.ace_sids[ace_id]] += records
+        return self.sids.counts(sid_counts)
+
+    def rewrite(self, acl_id, targets):
+        # Add a target domain ACE after every template ACE whose pair is not already on the ACL
+        aces = self.acl_aces[acl_id]
+        current_sids = {self.ace_sids[ace_id] for ace_id in aces if self.sids.domain[self.ace_sids[ace_id]]}
+        new_file_perms = []
+        for ace_id in aces:
+            new_file_perms.append(self.ace_texts[ace_id])
+            target = targets[self.ace_sids[ace_id]]
+            if target and self.sids.ids.get(target) not in current_sids:
+                new_file_perms.append(f'{self.ace_heads[ace_id]};;;{target})')
+        return self.acl_prefixes[acl_id] + ''.join(new_file_perms) + self.acl_sacls[acl_id]
@@ -0,0 +1,134 @@
+"""
+Script: bench.py
+Description: Benchmarks each pipeline stage on synthetic exports using fake resolver and directory data
+
+Usage:
+    python bench.py [--sizes 100000,1000000,10000000] [--mode default|stream|mmap|fused]
+                    [--workdir DIR] [--output FILE] [--profile DIR]
+
+Each size is generated once with generate.py (kept in --workdir) and benchmarked in a fresh
+process so peak RSS is not carried over between sizes. Runs on any OS, peak RSS needs Linux.
+
+Author: Andrew Collings
+Created: 2026-10-18
+Updated: 2026-10-18
+License: MIT
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import parse, resolve, generate, instrument
+
+def run(export_file, mode, num_workers, profile_dir=None, window=10000, range_size=32 * 1024 * 1024):
+    with open(f'{export_file}.json', encoding='utf-8') as fixture_file:
+        fixture = json.load(fixture_file)
+    records = fixture['records']
+    export_bytes = os.path.getsize(export_file)
+    stats = instrument.start(progress=False, profile_dir=profile_dir)
+    max_pending = num_workers * 2
+    output_dir = tempfile.mkdtemp(prefix='bench-')
+    output_file = os.path.join(output_dir, 'restore.txt')
+    spill_dir = tempfile.mkdtemp(prefix='bench-spill-')
+    pool = instrument.pool(num_workers, name='parse')
+
+    if mode == 'default':
+        with stats.stage('load_file') as stage:
+            file_lines = list(parse.read_lines(export_file))
+            stage.items = records
+        with stats.stage('build_chunk') as stage:
+            chunked_lines = parse.build_chunk(file_lines, num_workers)
+            stage.items = records
+            del file_lines
+        with stats.stage('isolate_permissions', records):
+            chunked_files = parse.isolate_permissions(chunked_lines, pool)
+            del chunked_lines
+        with stats.stage('find_unique_sids', records):
+            sids = parse.find_unique_sids(chunked_files, pool)
+    else:
+        if mode == 'mmap':
+            with stats.stage('split_ranges'):
+                chunks = parse.split_ranges(export_file, range_size)
+        with stats.stage('find_unique_sids', records, export_bytes):
+            if mode == 'fused':
+                sids, spill_files = parse.fused_unique_sids(parse.stream_chunks(export_file, window), pool, spill_dir, max_pending)
+            elif mode == 'mmap':
+                sids = parse.stream_unique_sids(chunks, pool, max_pending)
+            else:
+                sids = parse.stream_unique_sids(parse.stream_chunks(export_file, window), pool, max_pending)
+
+    with stats.stage('resolve_sids', len(sids), unit='SIDs'):
+        resolve.resolve_sids(sids, resolve.FakeResolver({sid: tuple(account) for sid, account in fixture['accounts'].items()}))
+    pool.close()
+    pool.join()
+
+    pool = parse.rewrite_pool(num_workers, fixture['sid_pairs'])
+    if mode == 'default':
+        with stats.stage('match_perms', records):
+            new_perms = list(parse.match_perms(chunked_files, pool))
+        with stats.stage('write_output') as stage:
+            parse.write_restore(new_perms, output_file)
+            stage.items = records
+    else:
+        with stats.stage('match_perms+write_output', records):
+            if mode == 'fused':
+                parse.write_restore(parse.stream_perms(spill_files, pool, max_pending), output_file)
+            elif mode == 'mmap':
+                parse.write_restore(parse.stream_perms(chunks, pool, max_pending), output_file)
+            else:
+                parse.write_restore(parse.stream_perms(parse.stream_chunks(export_file, window), pool, max_pending), output_file)
+    pool.close()
+    pool.join()
+    report = stats.report()
+    if stats.profiler:
+        stats.profiler.dump_stats(os.path.join(profile_dir, 'main.prof'))
+    output_bytes = os.path.getsize(output_file)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    shutil.rmtree(spill_dir, ignore_errors=True)
+    return {'export': export_file, 'mode': mode, 'records': records, 'workers': num_workers,
+            'output_bytes': output_bytes, 'stages': report['stages']}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the permission pipeline on synthetic exports')
+    parser.add_argument('--sizes', default='100000,1000000,10000000', help='comma separated file counts (default: 100000,1000000,10000000)')
+    parser.add_argument('--mode', choices=['default', 'stream', 'mmap', 'fused'], default='default', help='pipeline to benchmark (default: default)')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='worker processes (default: CPU count)')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'permissions-bench'), help='where generated exports are kept')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--profile', help='save cProfile output of the benchmark process and every worker to this directory')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        with open(args.result, 'w', encoding='utf-8') as result_file:
+            json.dump(run(args.run, args.mode, args.workers, args.profile), result_file)
+        sys.exit()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = []
+    for size in (int(size) for size in args.sizes.split(',')):
+        export_file = os.path.join(args.workdir, f'export-{size}.txt')
+        if not os.path.isfile(f'{export_file}.json'):
+            print(f'Generating {size} files')
+            generate.generate(export_file, files=size)
+        result_file = os.path.join(args.workdir, f'result-{size}-{args.mode}.json')
+        command = [sys.executable, os.path.abspath(__file__), '--run', export_file, '--result', result_file, '--mode', args.mode, '--workers', str(args.workers)]
+        if args.profile:
+            command += ['--profile', os.path.join(args.profile, f'{size}-{args.mode}')]
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(result_file, encoding='utf-8') as result_json:
+            result = json.load(result_json)
+        results.append(result)
+        print(f"\n{size} files ({result['records']} records, {args.mode} mode, {result['workers']} workers)")
+        print(f"{'Stage':<28}{'Seconds':>10}{'Per second':>14}{'Peak RSS MB':>14}{'Worker RSS MB':>15}")
+        for stage in result['stages']:
+            print(f"{stage['stage']:<28}{stage['seconds']:>10}{str(stage['per_second']):>14}{str(stage['peak_rss_mb']):>14}{str(stage['worker_peak_rss_mb']):>15}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_json:
+            json.dump(results, output_json, indent=2)
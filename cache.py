@@ -0,0 +1,172 @@
+"""
+Module: cache.py
+Description: Persistent cache of SID resolutions and directory snapshots shared between runs
+
+Usage:
+    python cache.py stats [--cache FILE]
+    python cache.py purge [--cache FILE] [--domain DOMAIN] [--expired] [--ttl HOURS]
+
+Author: Andrew Collings
+Created: 2026-10-18
+Updated: 2026-10-18
+License: MIT
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import resolve
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.permissions_cache.db')
+DEFAULT_TTL = 24
+
+schema = '''
+CREATE TABLE IF NOT EXISTS sids (sid TEXT PRIMARY KEY, domain TEXT, account TEXT, fetched REAL);
+CREATE TABLE IF NOT EXISTS names (domain TEXT, name TEXT, sid TEXT, fetched REAL, PRIMARY KEY (domain, name));
+CREATE TABLE IF NOT EXISTS snapshots (domain TEXT PRIMARY KEY, data BLOB, fetched REAL);
+'''
+
+class Cache:
+    # Lookups ignore rows older than the TTL. The lock lets the resolver thread pool share one connection.
+    def __init__(self, path=DEFAULT_PATH, ttl_hours=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(schema)
+
+    def cutoff(self):
+        return time.time() - self.ttl
+
+    def get_sids(self, sids):
+        found = {}
+        with self.lock:
+            for sid in sids:
+                row = self.conn.execute('SELECT account FROM sids WHERE sid = ? AND fetched >= ?', (sid, self.cutoff())).fetchone()
+                if row:
+                    account = json.loads(row[0])
+                    found[sid] = tuple(account) if account else None
+        return found
+
+    def put_sids(self, accounts):
+        now = time.time()
+        rows = [(sid, account[1] if account else '', json.dumps(list(account) if account else None), now) for sid, account in accounts]
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO sids VALUES (?, ?, ?, ?)', rows)
+
+    def get_names(self, domain, names):
+        found = {}
+        with self.lock:
+            for name in names:
+                row = self.conn.execute('SELECT sid FROM names WHERE domain = ? AND name = ? AND fetched >= ?', (domain, name, self.cutoff())).fetchone()
+                if row:
+                    found[name] = row[0]
+        return found
+
+    def put_names(self, domain, sids):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?)', [(domain, name, sid, now) for name, sid in sids])
+
+    def get_snapshot(self, domain):
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM snapshots WHERE domain = ? AND fetched >= ?', (domain, self.cutoff())).fetchone()
+        if not row:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def put_snapshot(self, domain, users, groups):
+        data = zlib.compress(json.dumps({'users': users, 'groups': groups}).encode())
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)', (domain, data, time.time()))
+
+    def stats(self):
+        cutoff = self.cutoff()
+        with self.lock:
+            counts = {}
+            for table in ('sids', 'names', 'snapshots'):
+                total, fresh = self.conn.execute(f'SELECT COUNT(*), COALESCE(SUM(fetched >= ?), 0) FROM {table}', (cutoff,)).fetchone()
+                counts[table] = (total, fresh)
+            unresolved = self.conn.execute("SELECT COUNT(*) FROM sids WHERE account = 'null'").fetchone()[0]
+            snapshots = self.conn.execute('SELECT domain, fetched, LENGTH(data) FROM snapshots ORDER BY domain').fetchall()
+        return counts, unresolved, snapshots
+
+    def purge(self, domain=None, expired=False):
+        conditions = []
+        params = []
+        if domain:
+            conditions.append('domain = ?')
+            params.append(domain)
+        if expired:
+            conditions.append('fetched < ?')
+            params.append(self.cutoff())
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        removed = 0
+        with self.lock, self.conn:
+            for table in ('sids', 'names', 'snapshots'):
+                removed += self.conn.execute(f'DELETE FROM {table}{where}', params).rowcount
+        return removed
+
+    def close(self):
+        self.conn.close()
+
+class CachedResolver(resolve.Resolver):
+    # Answers from the cache and only sends the misses to the wrapped resolver. Unmapped SIDs
+    # are cached as well so they are not looked up again until they expire, failed lookups are not.
+    def __init__(self, resolver, cache, domain=''):
+        self.resolver = resolver
+        self.cache = cache
+        self.domain = domain
+
+    def lookup_sid(self, sid):
+        return self.lookup_sids([sid])[0]
+
+    def lookup_name(self, name):
+        return self.lookup_names([name])[0]
+
+    def lookup_sids(self, sids):
+        accounts = self.cache.get_sids(sids)
+        misses = [sid for sid in sids if sid not in accounts]
+        if misses:
+            fetched = list(zip(misses, self.resolver.lookup_sids(misses)))
+            self.cache.put_sids([(sid, account) for sid, account in fetched if not isinstance(account, Exception)])
+            accounts.update(fetched)
+        return [accounts[sid] for sid in sids]
+
+    def lookup_names(self, names):
+        user_sids = self.cache.get_names(self.domain, names)
+        misses = [name for name in names if name not in user_sids]
+        if misses:
+            fetched = list(zip(misses, self.resolver.lookup_names(misses)))
+            self.cache.put_names(self.domain, [(name, sid) for name, sid in fetched if sid and not isinstance(sid, Exception)])
+            user_sids.update(fetched)
+        return [user_sids.get(name) for name in names]
+
+    def binary_sid(self, sid):
+        return self.resolver.binary_sid(sid)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspect or purge the SID and directory cache')
+    parser.add_argument('command', choices=['stats', 'purge'])
+    parser.add_argument('--cache', default=DEFAULT_PATH, help=f'cache file (default: {DEFAULT_PATH})')
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL, help=f'hours before an entry expires (default: {DEFAULT_TTL})')
+    parser.add_argument('--domain', help='only purge entries for this NetBIOS domain')
+    parser.add_argument('--expired', action='store_true', help='only purge entries older than the TTL')
+    args = parser.parse_args()
+
+    directory_cache = Cache(args.cache, args.ttl)
+    if args.command == 'stats':
+        counts, unresolved, snapshots = directory_cache.stats()
+        print(f'Cache file: {args.cache}')
+        for table, (total, fresh) in counts.items():
+            print(f'{table}: {total} entries, {fresh} fresh, {total - fresh} expired')
+        print(f'Unresolved SIDs cached: {unresolved}')
+        for domain, fetched, size in snapshots:
+            print(f'Snapshot {domain}: {(time.time() - fetched) / 3600:.1f} hours old, {size} bytes')
+    else:
+        print(f'Removed {directory_cache.purge(args.domain, args.expired)} entries')
+    directory_cache.close()
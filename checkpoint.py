@@ -0,0 +1,98 @@
+"""
+Module: checkpoint.py
+Description: Persists the results of each pipeline stage so an interrupted run can resume where it stopped
+
+Author: Andrew Collings
+Created: 2026-10-18
+Updated: 2026-10-18
+License: MIT
+"""
+
+import json
+import os
+import parse
+
+CHECKPOINT_VERSION = 2
+# Stages in pipeline order, a resumed run continues after the last one that was saved
+STAGES = ['records', 'sids', 'resolved', 'directory', 'users', 'plan']
+
+def export_identity(export_file):
+    stat = os.stat(export_file)
+    return {'path': os.path.abspath(export_file), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def write_json(file_name, data):
+    # Written next to the target and renamed over it so a crash never leaves half a file
+    with open(f'{file_name}.tmp', 'w', encoding='utf-8') as json_file:
+        json.dump(data, json_file, separators=(',', ':'))
+    os.replace(f'{file_name}.tmp', file_name)
+
+def strip_binary_sids(rows):
+    # Binary SIDs are PySID objects on Windows, they are rebuilt from the string SID on resume
+    return [[row[0], None] + row[2:] for row in rows]
+
+def restore_binary_sids(rows, resolver):
+    for row in rows:
+        row[1] = resolver.binary_sid(row[0])
+    return rows
+
+class Checkpoint:
+    # Parsed records are kept as pickled acl.Chunk spill files under records/<export number>/, or as
+    # the byte ranges of the export itself in --mmap mode. Every other stage is a small JSON file listed
+    # in manifest.json. Domain controller credentials are never written.
+    def __init__(self, directory, export_files):
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, 'manifest.json')
+        os.makedirs(directory, exist_ok=True)
+        exports = [export_identity(export_file) for export_file in export_files]
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file, 'r', encoding='utf-8') as manifest_json:
+                self.manifest = json.load(manifest_json)
+            if self.manifest.get('version') != CHECKPOINT_VERSION:
+                raise ValueError(f'{directory} holds a version {self.manifest.get("version")} checkpoint, expected version {CHECKPOINT_VERSION}')
+            if self.manifest['exports'] != exports:
+                paths = ', '.join(export['path'] for export in self.manifest['exports'])
+                raise ValueError(f'{directory} holds a checkpoint of {paths} as they were before a change, delete it or use another directory')
+        else:
+            self.manifest = {'version': CHECKPOINT_VERSION, 'exports': exports, 'stages': []}
+            write_json(self.manifest_file, self.manifest)
+
+    def records_dir(self, index):
+        records_dir = os.path.join(self.directory, 'records', f'{index:03d}')
+        os.makedirs(records_dir, exist_ok=True)
+        return records_dir
+
+    def has(self, stage):
+        return stage in self.manifest['stages']
+
+    def resumed(self):
+        # The last saved stage, or None for a fresh checkpoint
+        saved = [stage for stage in STAGES if self.has(stage)]
+        return saved[-1] if saved else None
+
+    def stage_file(self, stage):
+        return os.path.join(self.directory, f'{stage}.json')
+
+    def save(self, stage, data):
+        write_json(self.stage_file(stage), data)
+        if stage not in self.manifest['stages']:
+            self.manifest['stages'].append(stage)
+            write_json(self.manifest_file, self.manifest)
+
+    def load(self, stage):
+        with open(self.stage_file(stage), 'r', encoding='utf-8') as stage_json:
+            return json.load(stage_json)
+
+    def save_records(self, sources):
+        # sources holds a ('ranges', byte ranges) or ('spill', spill files) pair for each export
+        self.save('records', [{'kind': kind, 'ranges': chunks} if kind == 'ranges' else {'kind': kind, 'chunks': len(chunks)}
+                              for kind, chunks in sources])
+
+    def load_records(self):
+        # The sources passed to save_records, both kinds are usable as parse chunk specs
+        sources = []
+        for index, records in enumerate(self.load('records')):
+            if records['kind'] == 'ranges':
+                sources.append(('ranges', [tuple(chunk) for chunk in records['ranges']]))
+            else:
+                sources.append(('spill', [parse.spill_file(self.records_dir(index), chunk) for chunk in range(records['chunks'])]))
+        return sources
@@ -4,7 +4,7 @@ Description: Correlates objects between domains
 
 Author: Andrew Collings
 Created: 2025-02-09
-Updated: 2025-02-11
+Updated: 2026-10-18
 License: MIT
 """
 
@@ -12,22 +12,71 @@ import questionary
 from prompt_toolkit import prompt
 from prompt_toolkit.completion import WordCompleter, FuzzyCompleter
 import sys
+import collections
 
-def users(filtered_users, domain_users, template_domain, target_domain):
+GRAM = 3
+
+class NameIndex:
+    # Exact, first word, word and trigram lookups over a list of names. Lookups return
+    # positions in insertion order so results match a linear scan of the same list.
+    def __init__(self, names=()):
+        self.names = []
+        self.positions = {}
+        self.first_words = collections.defaultdict(list)
+        self.words = collections.defaultdict(list)
+        self.grams = collections.defaultdict(list)
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        position = len(self.names)
+        self.names.append(name)
+        self.positions.setdefault(name, position)
+        words = name.split()
+        if words:
+            self.first_words[words[0]].append(position)
+        for word in set(words):
+            self.words[word].append(position)
+        for gram in {name[i:i + GRAM] for i in range(len(name) - GRAM + 1)}:
+            self.grams[gram].append(position)
+
+    def containing(self, text):
+        # Every name with text as a substring. Candidates share all of text's trigrams.
+        if len(text) < GRAM:
+            return [position for position, name in enumerate(self.names) if text in name]
+        grams = sorted({text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}, key=lambda gram: len(self.grams.get(gram, ())))
+        candidates = set(self.grams.get(grams[0], ()))
+        for gram in grams[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(self.grams[gram])
+        return sorted(position for position in candidates if text in self.names[position])
+
+    def first_word(self, word):
+        return self.first_words.get(word, [])
+
+    def sharing_word(self, words):
+        return sorted({position for word in set(words) for position in self.words.get(word, ())})
+
+def users(filtered_users, domain_users, template_domain, target_domain, target_index=None):
     print('Correlating users')
+    template_names = {}
+    for j in domain_users[template_domain]:
+        template_names.setdefault(j['name'], j['full_name'])
     for i in range(len(filtered_users)):
-        for j in domain_users[template_domain]:
-            if j['name'] == filtered_users[i][2]:
-                filtered_users[i].append(j['full_name'])
-                break
+        if filtered_users[i][2] in template_names:
+            filtered_users[i].append(template_names[filtered_users[i][2]])
     
-    all_users = {user['full_name']:user['name'] for user in domain_users[target_domain]}
+    target_users = domain_users[target_domain]
+    if target_index is None:
+        target_index = NameIndex(j['full_name'] for j in target_users)
+    all_users = {user['full_name']:user['name'] for user in target_users}
     no_user_match = []
     for i in range(len(filtered_users)):
-        exact_matches = []
-        for j in domain_users[target_domain]:
-            if filtered_users[i][5] in j['full_name']:
-                exact_matches.append([j['full_name'],j['name']])
+        exact_matches = [[target_users[j]['full_name'], target_users[j]['name']] for j in target_index.containing(filtered_users[i][5])]
         if len(exact_matches) == 1:
             filtered_users[i].extend(exact_matches[0])
         if len(exact_matches) > 1:
@@ -36,10 +85,8 @@ def users(filtered_users, domain_users, template_domain, target_domain):
             
         if not exact_matches:
             potential_matches = {}
-            for j in domain_users[target_domain]:
-                if j['full_name']:
-                    if j['full_name'].split()[0] == filtered_users[i][5].split()[0]:
-                        potential_matches.update({j['full_name']:j['name']})
+            for j in target_index.first_word(filtered_users[i][5].split()[0]):
+                potential_matches.update({target_users[j]['full_name']:target_users[j]['name']})
             if potential_matches:
                 selected_match = questionary.select(f'No exact match was found for {filtered_users[i][5]} ({filtered_users[i][2]}), please select from the following rough matches:', choices=list(potential_matches.keys()) + ['None of these']).ask()
                 if selected_match == 'None of these':
@@ -75,30 +122,31 @@ def users(filtered_users, domain_users, template_domain, target_domain):
     else:
         return filtered_users
 
-def groups(filtered_groups, domain_groups, target_domain):
+def groups(filtered_groups, domain_groups, target_domain, target_index=None, group_modifier=None):
     for j in domain_groups.keys():
         domain_groups[j] = {value: key for key, value in domain_groups[j].items()}
-    group_modifier = input('If the groups in the target domain have a common suffix please enter it (including any spaces). Otherwise, just press Enter: ')
+    if target_index is None:
+        target_index = NameIndex(domain_groups[target_domain].keys())
+    if group_modifier is None:
+        group_modifier = input('If the groups in the target domain have a common suffix please enter it (including any spaces). Otherwise, just press Enter: ')
     no_group_match = []
     for i in range(len(filtered_groups)):
         exact_match = False
         no_match = True
-        for j in domain_groups[target_domain].keys():
-            if filtered_groups[i][2] + group_modifier == j or filtered_groups[i][2] == j:
-                filtered_groups[i].extend([j, domain_groups[target_domain][j]])
-                exact_match = True
-                no_match = False
-                break
+        exact_names = [j for j in (filtered_groups[i][2] + group_modifier, filtered_groups[i][2]) if j in target_index.positions]
+        if exact_names:
+            j = min(exact_names, key=target_index.positions.get)
+            filtered_groups[i].extend([j, domain_groups[target_domain][j]])
+            exact_match = True
+            no_match = False
             
         if not exact_match:
             potential_matches = []
-            for j in domain_groups[target_domain].keys():
-                if filtered_groups[i][2] in j:
-                    potential_matches.append([j, domain_groups[target_domain][j]])
+            for j in target_index.containing(filtered_groups[i][2]):
+                potential_matches.append([target_index.names[j], domain_groups[target_domain][target_index.names[j]]])
             if not potential_matches:
-                for j in domain_groups[target_domain].keys():
-                    if any(item in filtered_groups[i][2].split() for item in j.split()):
-                        potential_matches.append([j,domain_groups[target_domain][j]])
+                for j in target_index.sharing_word(filtered_groups[i][2].split()):
+                    potential_matches.append([target_index.names[j], domain_groups[target_domain][target_index.names[j]]])
                         
 
             if potential_matches:
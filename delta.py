@@ -0,0 +1,108 @@
+"""
+Module: delta.py
+Description: Fingerprints icacls exports so a later export can be reduced to the records that changed
+
+Author: Andrew Collings
+Created: 2026-10-18
+Updated: 2026-10-18
+License: MIT
+"""
+
+import array
+import bisect
+import hashlib
+import heapq
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import instrument
+
+MAGIC = b'ICFP0001'
+# Fingerprints written per block while merging
+MERGE_BLOCK = 65536
+
+def fingerprint(text, export=0):
+    # Paths are salted with the position of their export because icacls paths are relative, so two
+    # shares can hold the same one. Export 0 hashes as if unsalted, which keeps older indexes valid.
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-16-le'), digest_size=8, salt=struct.pack('<Q', export)).digest(), 'little')
+
+def fingerprint_records(records, export=0):
+    # Path and ACL fingerprints of a chunk of records as a run sorted by path, so the parent only merges
+    pairs = sorted((fingerprint(line[0], export), fingerprint(line[1] or '')) for line in records)
+    return array.array('Q', (path for path, acl in pairs)), array.array('Q', (acl for path, acl in pairs))
+
+def is_index(file_name):
+    with open(file_name, 'rb') as index_file:
+        return index_file.read(len(MAGIC)) == MAGIC
+
+def run_pairs(view, start, count):
+    for i in range(start, start + count):
+        yield view[i], view[i + count]
+
+def build_index(runs, index_file):
+    # File layout: magic, record count, sorted path fingerprints, then the matching ACL fingerprints.
+    # runs come from fingerprint_records. They are spilled to disk as they arrive and merged from there,
+    # so memory stays flat however large the export is.
+    work_dir = tempfile.mkdtemp(prefix='fingerprints-', dir=os.path.dirname(os.path.abspath(index_file)))
+    try:
+        run_file = os.path.join(work_dir, 'runs')
+        bounds = []
+        with open(run_file, 'wb') as runs_out:
+            for paths, acls in runs:
+                paths.tofile(runs_out)
+                acls.tofile(runs_out)
+                bounds.append(len(paths))
+                instrument.advance(len(paths))
+        count = sum(bounds)
+        values_file = os.path.join(work_dir, 'values')
+        with open(index_file, 'wb') as fingerprints, open(values_file, 'wb') as values_out:
+            fingerprints.write(MAGIC)
+            fingerprints.write(struct.pack('<Q', count))
+            if count:
+                with open(run_file, 'rb') as runs_in, mmap.mmap(runs_in.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                        memoryview(mm) as raw, raw.cast('Q') as view:
+                    starts = [0]
+                    for run_count in bounds[:-1]:
+                        starts.append(starts[-1] + 2 * run_count)
+                    keys = array.array('Q')
+                    values = array.array('Q')
+                    for path, acl in heapq.merge(*(run_pairs(view, start, run_count) for start, run_count in zip(starts, bounds) if run_count)):
+                        keys.append(path)
+                        values.append(acl)
+                        if len(keys) >= MERGE_BLOCK:
+                            keys.tofile(fingerprints)
+                            values.tofile(values_out)
+                            keys = array.array('Q')
+                            values = array.array('Q')
+                    keys.tofile(fingerprints)
+                    values.tofile(values_out)
+            values_out.close()
+            with open(values_file, 'rb') as values_in:
+                shutil.copyfileobj(values_in, fingerprints, 1 << 20)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return count
+
+class Index:
+    # Memory-maps an index built by build_index, so every worker shares the same pages
+    def __init__(self, index_file):
+        self.file = open(index_file, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{index_file} is not a fingerprint index')
+        count = struct.unpack_from('<Q', self.mm, len(MAGIC))[0]
+        start = len(MAGIC) + 8
+        view = memoryview(self.mm)
+        self.keys = view[start:start + count * 8].cast('Q')
+        self.values = view[start + count * 8:start + count * 16].cast('Q')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def changed(self, path, acl, export=0):
+        # True for paths that are new or whose ACL differs from the previous export at the same position
+        key = fingerprint(path, export)
+        i = bisect.bisect_left(self.keys, key)
+        return not (i < len(self.keys) and self.keys[i] == key and self.values[i] == fingerprint(acl))
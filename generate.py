@@ -0,0 +1,100 @@
+"""
+Script: generate.py
+Description: Generates synthetic icacls exports and matching fake directory data for benchmarking
+
+Usage:
+    python generate.py <output export> [--files N] [--shared-ratio R] [--shared-acls N] [--aces N]
+                       [--sacl-fraction F] [--users N] [--groups N] [--seed N]
+
+Writes the UTF-16 export and <output export>.json holding the accounts for resolve.FakeResolver,
+the users and groups of both domains, the template to target SID pairs and the record count.
+
+Author: Andrew Collings
+Created: 2026-10-18
+Updated: 2026-10-18
+License: MIT
+"""
+
+import argparse
+import json
+import random
+
+TEMPLATE_DOMAIN = 'OLDCORP'
+TARGET_DOMAIN = 'NEWCORP'
+TEMPLATE_PREFIX = 'S-1-5-21-1111111111-2222222222-3333333333'
+TARGET_PREFIX = 'S-1-5-21-4444444444-5555555555-6666666666'
+WELL_KNOWN = ['BA', 'SY', 'CO', 'AU']
+ACE_HEADS = ['(A;OICIID;FA;;', '(A;OICIID;0x1301bf;;', '(A;OICIID;0x1200a9;;', '(A;ID;FA;;', '(A;OICI;0x1301bf;;']
+FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Jamie', 'Robin', 'Avery', 'Quinn']
+LAST_NAMES = ['Smith', 'Jones', 'Brown', 'Garcia', 'Miller', 'Davis', 'Wilson', 'Moore', 'Clark', 'Lewis']
+
+def directory(users, groups):
+    # Both domains hold the same accounts under different SIDs, users are RID 1000+, groups 500000+
+    accounts = {}
+    domain_users = {TEMPLATE_DOMAIN: [], TARGET_DOMAIN: []}
+    domain_groups = {TEMPLATE_DOMAIN: {}, TARGET_DOMAIN: {}}
+    sid_pairs = {}
+    for domain, prefix in ((TEMPLATE_DOMAIN, TEMPLATE_PREFIX), (TARGET_DOMAIN, TARGET_PREFIX)):
+        for i in range(users):
+            name = f'user{i}'
+            accounts[f'{prefix}-{1000 + i}'] = [name, domain, 1]
+            domain_users[domain].append({'name': name, 'full_name': f'{FIRST_NAMES[i % 10]} {LAST_NAMES[i // 10 % 10]} {i}', 'flags': 512})
+        for i in range(groups):
+            accounts[f'{prefix}-{500000 + i}'] = [f'Group {i}', domain, 2]
+            domain_groups[domain][f'{prefix}-{500000 + i}'] = f'Group {i}'
+    for rid in list(range(1000, 1000 + users)) + list(range(500000, 500000 + groups)):
+        sid_pairs[f'{TEMPLATE_PREFIX}-{rid}'] = f'{TARGET_PREFIX}-{rid}'
+    return {'template_domain': TEMPLATE_DOMAIN, 'target_domain': TARGET_DOMAIN, 'accounts': accounts,
+            'domain_users': domain_users, 'domain_groups': domain_groups, 'sid_pairs': sid_pairs}
+
+def make_acl(rng, template_sids, aces, sacl_fraction):
+    count = rng.randint(1, max(1, aces * 2 - 1))
+    ace_list = [f'(A;OICIID;FA;;;{rng.choice(WELL_KNOWN)})']
+    ace_list.extend(f'{rng.choice(ACE_HEADS)};{rng.choice(template_sids)})' for _ in range(count))
+    sacl = 'S:AI(AU;OICISAFA;FA;;;WD)' if rng.random() < sacl_fraction else ''
+    return f'D:AI{"".join(ace_list)}{sacl}'
+
+def records(rng, files, template_sids, shared_ratio, shared_acls, aces, sacl_fraction):
+    # Paths are emitted depth first like icacls /save, with a directory record before its contents
+    shared = [make_acl(rng, template_sids, aces, sacl_fraction) for _ in range(shared_acls)]
+    yield 'share', shared[0]
+    for i in range(files):
+        if i % 1000 == 0:
+            yield f'share\\d{i // 1000}', rng.choice(shared)
+        if i % 50 == 0:
+            yield f'share\\d{i // 1000}\\s{i // 50}', rng.choice(shared)
+        if rng.random() < shared_ratio:
+            acl = rng.choice(shared)
+        else:
+            acl = make_acl(rng, template_sids, aces, sacl_fraction)
+        yield f'share\\d{i // 1000}\\s{i // 50}\\file {i}.txt', acl
+
+def generate(file_name, files=100000, shared_ratio=0.95, shared_acls=200, aces=4, sacl_fraction=0.05, users=2000, groups=500, seed=1):
+    rng = random.Random(seed)
+    fixture = directory(users, groups)
+    template_sids = [sid for sid in fixture['accounts'] if sid.startswith(TEMPLATE_PREFIX)]
+    written = 0
+    with open(file_name, 'w', encoding='utf-16-le', newline='\r\n', buffering=1 << 20) as acl_file:
+        acl_file.write('\ufeff')
+        for path, acl in records(rng, files, template_sids, shared_ratio, shared_acls, aces, sacl_fraction):
+            acl_file.write(f'{path}\n{acl}\n')
+            written += 1
+    fixture['records'] = written
+    with open(f'{file_name}.json', 'w', encoding='utf-8') as fixture_file:
+        json.dump(fixture, fixture_file)
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic icacls export and fake directory data')
+    parser.add_argument('output', help='export file to write, the directory data goes to <output>.json')
+    parser.add_argument('--files', type=int, default=100000, help='number of files (default: 100000)')
+    parser.add_argument('--shared-ratio', type=float, default=0.95, help='fraction of files that reuse a shared ACL (default: 0.95)')
+    parser.add_argument('--shared-acls', type=int, default=200, help='number of distinct shared ACLs (default: 200)')
+    parser.add_argument('--aces', type=int, default=4, help='average domain ACEs per ACL (default: 4)')
+    parser.add_argument('--sacl-fraction', type=float, default=0.05, help='fraction of ACLs with a SACL (default: 0.05)')
+    parser.add_argument('--users', type=int, default=2000, help='users per domain (default: 2000)')
+    parser.add_argument('--groups', type=int, default=500, help='groups per domain (default: 500)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default: 1)')
+    args = parser.parse_args()
+    written = generate(args.output, args.files, args.shared_ratio, args.shared_acls, args.aces, args.sacl_fraction, args.users, args.groups, args.seed)
+    print(f'Wrote {written} records to {args.output}')
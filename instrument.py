@@ -0,0 +1,267 @@
+"""
+Module: instrument.py
+Description: Records stage timings, throughput, memory, DC round trips and worker profiles of a run
+
+Author: Andrew Collings
+Created: 2026-10-18
+Updated: 2026-10-18
+License: MIT
+"""
+
+import contextlib
+import cProfile
+import datetime
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import sys
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROGRESS_INTERVAL = 0.5
+
+# The active run, set by start(). Everything below does nothing while it is None,
+# so worker processes and other scripts can call it without setting anything up.
+run = None
+# Kept alive in each profiled worker until the worker exits and dumps it
+worker_profiler = None
+
+def peak_rss_mb(pid=None):
+    # Peak resident memory of a process in MB. /proc has the true peak on Linux and psutil has it
+    # on Windows (peak_wset). Elsewhere psutil only has the current size, which is sampled instead.
+    try:
+        with open(f'/proc/{pid or "self"}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if psutil:
+        try:
+            info = psutil.Process(pid).memory_info()
+        except psutil.Error:
+            return None
+        return round(getattr(info, 'peak_wset', info.rss) / 1024 / 1024, 1)
+    if pid is None and resource:
+        # ru_maxrss is in KB on Linux and bytes on macOS
+        scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+    return None
+
+def worker_peak_rss_mb():
+    peaks = [peak_rss_mb(child.pid) for child in multiprocessing.active_children()]
+    peaks = [peak for peak in peaks if peak is not None]
+    return max(peaks) if peaks else None
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
+
+class Stage:
+    # total is in items (records unless unit says otherwise), total_bytes in bytes of input.
+    # When total_bytes is set the ETA follows the bytes, which are known before the records are.
+    def __init__(self, name, total=None, total_bytes=None, unit='records', interactive=False):
+        self.name = name
+        self.total = total
+        self.total_bytes = total_bytes
+        self.unit = unit
+        self.interactive = interactive
+        self.items = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.peak_rss_mb = None
+        self.worker_peak_rss_mb = None
+
+    def fraction(self):
+        if self.total_bytes:
+            return min(self.bytes / self.total_bytes, 1)
+        if self.total:
+            return min(self.items / self.total, 1)
+        return None
+
+    def report(self):
+        return {
+            'stage': self.name,
+            'seconds': round(self.seconds, 3),
+            'unit': self.unit,
+            'items': self.items,
+            'per_second': round(self.items / self.seconds) if self.items and self.seconds else None,
+            'bytes': self.bytes,
+            'peak_rss_mb': self.peak_rss_mb,
+            'worker_peak_rss_mb': self.worker_peak_rss_mb,
+            'interactive': self.interactive,
+        }
+
+class Run:
+    def __init__(self, progress=None, profile_dir=None):
+        self.started = datetime.datetime.now()
+        self.start = time.perf_counter()
+        self.stages = []
+        self.current = None
+        self.dc_calls = {}
+        self.lock = threading.Lock()
+        self.progress = sys.stdout.isatty() if progress is None else progress
+        self.profile_dir = profile_dir
+        self.profiler = None
+        self.last_shown = 0
+        self.shown = 0
+
+    @contextlib.contextmanager
+    def stage(self, name, total=None, total_bytes=None, unit='records', interactive=False):
+        stage = Stage(name, total, total_bytes, unit, interactive)
+        self.stages.append(stage)
+        self.current = stage
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - stage.start
+            self.sample(stage)
+            self.current = None
+            if self.shown:
+                print()
+                self.shown = 0
+
+    def sample(self, stage):
+        for key, peak in (('peak_rss_mb', peak_rss_mb()), ('worker_peak_rss_mb', worker_peak_rss_mb())):
+            if peak is not None:
+                setattr(stage, key, max(peak, getattr(stage, key) or 0))
+
+    def advance(self, items=0, size=0):
+        stage = self.current
+        if not stage:
+            return
+        with self.lock:
+            stage.items += items
+            stage.bytes += size
+        now = time.perf_counter()
+        if now - self.last_shown < PROGRESS_INTERVAL:
+            return
+        self.last_shown = now
+        self.sample(stage)
+        if self.progress:
+            self.show(stage, now - stage.start)
+
+    def show(self, stage, elapsed):
+        line = f'  {stage.name}: {stage.items:,} {stage.unit}'
+        if elapsed and stage.items:
+            line += f' at {stage.items / elapsed:,.0f}/s'
+        fraction = stage.fraction()
+        if fraction:
+            line += f', {fraction:.1%} done, ETA {format_duration(elapsed * (1 - fraction) / fraction)}'
+        print(f'\r{line.ljust(self.shown)}', end='', flush=True)
+        self.shown = len(line)
+
+    def dc_call(self, kind, seconds):
+        with self.lock:
+            self.dc_calls.setdefault(kind, []).append(seconds)
+
+    def report(self):
+        dc_calls = {}
+        for kind, latencies in self.dc_calls.items():
+            latencies = sorted(latencies)
+            dc_calls[kind] = {
+                'calls': len(latencies),
+                'seconds': round(sum(latencies), 3),
+                'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+                'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 1),
+                'max_ms': round(latencies[-1] * 1000, 1),
+            }
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'seconds': round(time.perf_counter() - self.start, 3),
+            'argv': sys.argv,
+            'workers': multiprocessing.cpu_count(),
+            'stages': [stage.report() for stage in self.stages],
+            'dc_calls': dc_calls,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+    def summary(self):
+        report = self.report()
+        print(f"\n{'Stage':<28}{'Seconds':>10}{'Items':>12}{'Per second':>12}{'Peak MB':>10}{'Worker MB':>11}")
+        for stage in report['stages']:
+            name = stage['stage'] + (' *' if stage['interactive'] else '')
+            print(f"{name:<28}{stage['seconds']:>10}{stage['items']:>12}{str(stage['per_second']):>12}{str(stage['peak_rss_mb']):>10}{str(stage['worker_peak_rss_mb']):>11}")
+        if any(stage['interactive'] for stage in report['stages']):
+            print('* includes time spent waiting at prompts')
+        for kind, calls in report['dc_calls'].items():
+            print(f"{kind}: {calls['calls']} calls, {calls['seconds']}s, p50 {calls['p50_ms']}ms, p95 {calls['p95_ms']}ms, max {calls['max_ms']}ms")
+        print(f"Total {format_duration(report['seconds'])}")
+        return report
+
+def start(progress=None, profile_dir=None):
+    global run
+    run = Run(progress, profile_dir)
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        run.profiler = cProfile.Profile()
+        run.profiler.enable()
+    return run
+
+def finish(report_file=None):
+    global run
+    if not run:
+        return None
+    if run.profiler:
+        run.profiler.dump_stats(os.path.join(run.profile_dir, 'main.prof'))
+        print(f'Profiles saved to {run.profile_dir}')
+    report = run.summary()
+    if report_file:
+        with open(report_file, 'w', encoding='utf-8') as report_json:
+            json.dump(report, report_json, indent=2)
+        print(f'Run report saved to {report_file}')
+    run = None
+    return report
+
+def stage(name, total=None, total_bytes=None, unit='records', interactive=False):
+    if not run:
+        return contextlib.nullcontext()
+    return run.stage(name, total, total_bytes, unit, interactive)
+
+def advance(items=0, size=0):
+    if run:
+        run.advance(items, size)
+
+def dc_call(kind, seconds):
+    if run:
+        run.dc_call(kind, seconds)
+
+@contextlib.contextmanager
+def dc_timer(kind):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        dc_call(kind, time.perf_counter() - start)
+
+def profile_worker(prefix, initializer, initargs):
+    # Pool initializer that profiles the worker until it exits. Pool workers skip atexit,
+    # but multiprocessing runs its own finalizers on the way out. A forked worker inherits the
+    # main process profiler still enabled, which has to be stopped before another can start.
+    global worker_profiler
+    if run and run.profiler:
+        run.profiler.disable()
+    worker_profiler = cProfile.Profile()
+    multiprocessing.util.Finalize(None, worker_profiler.dump_stats, args=(f'{prefix}-{os.getpid()}.prof',), exitpriority=10)
+    if initializer:
+        initializer(*initargs)
+    worker_profiler.enable()
+
+def pool(num_workers, initializer=None, initargs=(), name='pool'):
+    # multiprocessing.Pool that profiles each worker into the run's profile directory when there is one
+    if run and run.profile_dir:
+        return multiprocessing.Pool(num_workers, initializer=profile_worker, initargs=(os.path.join(run.profile_dir, name), initializer, initargs))
+    return multiprocessing.Pool(num_workers, initializer=initializer, initargs=initargs)
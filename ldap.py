@@ -1,26 +1,109 @@
 """
 Module: ldap.py
-Description: Pulls group data from LDAP
+Description: Pulls user and group data from LDAP
 
 Author: Andrew Collings
 Created: 2025-02-08
-Updated: 2025-02-11
+Updated: 2026-10-18
 License: MIT
 """
 
 from ldap3 import Server, Connection, NTLM, SUBTREE
+from ldap3.protocol.formatters.formatters import format_sid
+import concurrent.futures
+import correlate
+import instrument
 
-def get_groups(dc_fqns):
-    print('Getting groups from LDAP')
+PAGE_SIZE = 1000
+PAGED_RESULTS = '1.2.840.113556.1.4.319'
+UF_NORMAL_ACCOUNT = 0x200
+
+# Computers are also objectClass=user, they are dropped by the UF_NORMAL_ACCOUNT check below
+directory_filter = '(|(objectClass=group)(objectClass=user))'
+attributes = ['objectClass', 'cn', 'objectSid', 'sAMAccountName', 'displayName', 'userAccountControl']
+
+def base_dn(fqdn):
+    return f"dc={fqdn.split('.')[-2]},dc={fqdn.split('.')[-1]}"
+
+def connect(domain, creds):
+    server = Server(f"ldap://{creds[0]}", port=389)
+    return Connection(server, user=f'{domain.lower()}\\{creds[1]}', password=creds[2], authentication=NTLM, auto_bind=True)
+
+def first_value(value):
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+def paged_entries(conn, search_base):
+    # One search per page so each round trip to the DC is timed on its own
+    cookie = None
+    while True:
+        with instrument.dc_timer('ldap_page'):
+            conn.search(search_base=search_base, search_filter=directory_filter, search_scope=SUBTREE,
+                        attributes=attributes, paged_size=PAGE_SIZE, paged_cookie=cookie)
+        yield from conn.response
+        cookie = conn.result.get('controls', {}).get(PAGED_RESULTS, {}).get('value', {}).get('cookie')
+        if not cookie:
+            break
+
+def fetch_domain(domain, creds, connection=connect):
+    # Users are shaped like NetUserEnum level 2 entries so correlate.py and w32.skip_disabled work unchanged
+    with instrument.dc_timer('ldap_bind'):
+        conn = connection(domain, creds)
+    users = []
+    groups = {}
+    user_index = correlate.NameIndex()
+    group_index = correlate.NameIndex()
+    for entry in paged_entries(conn, base_dn(creds[0])):
+        if entry.get('type') != 'searchResEntry':
+            continue
+        instrument.advance(1)
+        values = entry['attributes']
+        sid = first_value(values.get('objectSid'))
+        if isinstance(sid, bytes):
+            sid = format_sid(sid)
+        object_classes = [item.lower() for item in values.get('objectClass', [])]
+        if 'group' in object_classes:
+            cn = first_value(values.get('cn'))
+            groups[sid] = cn
+            if cn not in group_index.positions:
+                group_index.add(cn)
+            continue
+        flags = int(first_value(values.get('userAccountControl')) or 0)
+        if not flags & UF_NORMAL_ACCOUNT:
+            continue
+        user = {'name': first_value(values.get('sAMAccountName')), 'full_name': first_value(values.get('displayName')) or '', 'flags': flags}
+        users.append(user)
+        user_index.add(user['full_name'])
+    conn.unbind()
+    return users, groups, user_index, group_index
+
+def index_directory(users, groups):
+    # Rebuilds the name indexes of a directory snapshot saved without them
+    return correlate.NameIndex(user['full_name'] for user in users), correlate.NameIndex(dict.fromkeys(groups.values()))
+
+def cached_fetch(domain, creds, connection, cache, snapshot=None):
+    # snapshot is one the caller already loaded, it is used even if it has expired since
+    if snapshot is None and cache:
+        snapshot = cache.get_snapshot(domain)
+    if snapshot:
+        print(f'Using cached users and groups for {domain}')
+        users = snapshot['users']
+        groups = snapshot['groups']
+        return (users, groups) + index_directory(users, groups)
+    users, groups, user_index, group_index = fetch_domain(domain, creds, connection)
+    if cache:
+        cache.put_snapshot(domain, users, groups)
+    return users, groups, user_index, group_index
+
+def get_directory(dc_fqns, connection=connect, cache=None, snapshots=None):
+    print('Getting users and groups from LDAP')
+    domain_users = {}
     domain_groups = {}
-    group_filter = '(objectClass=group)'
-    attributes = ["cn", "distinguishedName", 'objectSid']  # Adjust attributes as needed
-    for domain in dc_fqns:
-        ldap_server = f"ldap://{dc_fqns[domain][0]}"
-        base_dn = f"dc={dc_fqns[domain][0].split('.')[-2]},dc={dc_fqns[domain][0].split('.')[-1]}"
-        server = Server(ldap_server,port= 389)
-        conn = Connection(server, user=f'{domain.lower()}\\{dc_fqns[domain][1]}', password=dc_fqns[domain][2], authentication=NTLM, auto_bind=True)
-        conn.search(search_base=base_dn, search_filter=group_filter, search_scope=SUBTREE, attributes=attributes)
-        domain_groups.update({domain: {entry.objectSid.value: entry.cn.value for entry in conn.entries}})
-        conn.unbind()
-    return domain_groups
+    user_indexes = {}
+    group_indexes = {}
+    with concurrent.futures.ThreadPoolExecutor(max(len(dc_fqns), 1)) as executor:
+        futures = {domain: executor.submit(cached_fetch, domain, dc_fqns[domain], connection, cache, (snapshots or {}).get(domain)) for domain in dc_fqns}
+    for domain, future in futures.items():
+        domain_users[domain], domain_groups[domain], user_indexes[domain], group_indexes[domain] = future.result()
+    return domain_users, domain_groups, user_indexes, group_indexes
@@ -4,63 +4,253 @@ Description: Parses data for use by other functions
 
 Author: Andrew Collings
 Created: 2025-02-08
-Updated: 2025-02-11
+Updated: 2026-10-18
 License: MIT
 """
 
 import itertools
+import codecs
+import collections
+import gzip
+import io
+import mmap
+import operator
+import os
+import pickle
+import struct
+import acl
+import delta
+import instrument
+import shard
 
-def chunkify(lst, chunk_size):
-    for i in range(0, len(lst), chunk_size):
-        yield lst[i : i + chunk_size]
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+NEWLINE = '\n'.encode('utf-16-le')
+ACL_LINE_STARTS = tuple(prefix.encode('utf-16-le') for prefix in ('D:', 'O:', 'G:', 'S:'))
+ACL_CACHE_LIMIT = 65536
+TASK_ACES = 250000
+TASKS_PER_WORKER = 8
+# Restore files used to be written in text mode, which ends lines with os.linesep
+LINE_END = os.linesep
+OUTPUT_BUFFER = 1 << 20
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Installed once per worker by install_sid_pairs
+sid_pairs = {}
+delta_index = None
+shard_spec = None
+# Rewritten ACLs keyed by the original ACL text, kept per worker across chunks
+acl_cache = {}
+
+def compression(file_name):
+    # Exports are recognised by their magic bytes rather than their extension
+    with open(file_name, "rb") as export_file:
+        magic = export_file.read(len(ZSTD_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+def open_export(file_name):
+    # Text stream over a plain, gzip or zstd compressed export, decompressed as it is read
+    kind = compression(file_name)
+    if kind == 'gzip':
+        return gzip.open(file_name, "rt", encoding="utf-16-le")
+    if kind == 'zstd':
+        if not zstandard:
+            raise ImportError(f'{file_name} is zstd compressed, install the zstandard package to read it')
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(file_name, "rb"), closefd=True), encoding="utf-16-le")
+    return open(file_name, "r", encoding="utf-16-le")
+
+def export_size(file_name):
+    # Decoded size of an export, used for progress. gzip stores it modulo 4GB in its last four bytes
+    # and zstd in the frame header when the compressor knew it. None when it cannot be told.
+    kind = compression(file_name)
+    if kind is None:
+        return os.path.getsize(file_name)
+    with open(file_name, "rb") as export_file:
+        if kind == 'gzip':
+            export_file.seek(-4, os.SEEK_END)
+            size = struct.unpack('<I', export_file.read(4))[0]
+            return size if size >= os.path.getsize(file_name) else None
+        if zstandard:
+            size = zstandard.frame_content_size(export_file.read(18))
+            return size if size > 0 else None
+    return None
+
+def export_stem(file_name):
+    # share.txt.gz and share.txt.zst both give share
+    stem = os.path.basename(file_name)
+    for extension in ('.gz', '.zst', '.txt'):
+        if stem.lower().endswith(extension):
+            stem = stem[:-len(extension)]
+    return stem
+
+def read_lines(file_name):
+    with open_export(file_name) as acl_file:
+        for line in acl_file:
+            yield line.lstrip("\ufeff").strip()
+
+def pair_lines(lines):
+    for pair in itertools.zip_longest(*[iter(lines)]*2, fillvalue=None):
+        yield list(pair)
+
+def stream_chunks(file_name, window):
+    return size_chunks(pair_lines(read_lines(file_name)), TASK_ACES, window)
+
+def size_chunks(pairs, max_aces, max_records):
+    # Tasks are cut by ACE count as well as record count so files with huge ACLs make smaller tasks
+    chunk = []
+    aces = 0
+    for pair in pairs:
+        chunk.append(pair)
+        aces += 1 + (pair[1].count('(') if pair[1] else 0)
+        if aces >= max_aces or len(chunk) >= max_records:
+            yield chunk
+            chunk = []
+            aces = 0
+    if chunk:
+        yield chunk
+
+def next_line(mm, pos):
+    # A newline only counts if it sits on a UTF-16 code unit boundary
+    while True:
+        idx = mm.find(NEWLINE, pos)
+        if idx == -1:
+            return len(mm)
+        if idx % 2 == 0:
+            return idx + 2
+        pos = idx + 1
+
+def record_start(mm, pos):
+    # icacls paths are relative so only ACL lines begin with a "X:" SDDL component
+    start = next_line(mm, pos)
+    if mm[start:start + 4] in ACL_LINE_STARTS:
+        start = next_line(mm, start)
+    return start
+
+def split_ranges(file_name, range_size):
+    print("Split export into byte ranges")
+    ranges = []
+    if not os.path.getsize(file_name):
+        return ranges
+    with open(file_name, "rb") as acl_file, mmap.mmap(acl_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < len(mm):
+            end = record_start(mm, start + range_size) if start + range_size < len(mm) else len(mm)
+            ranges.append((file_name, start, end - start))
+            start = end
+    return ranges
+
+def range_bytes(file_name, offset, length):
+    with open(file_name, "rb") as acl_file, mmap.mmap(acl_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return mm[offset:offset + length]
+
+def range_records(data):
+    lines = [line.lstrip("\ufeff").strip() for line in data.decode('utf-16-le').split('\n')]
+    if lines and not lines[-1]:
+        lines.pop()
+    return [list(pair) for pair in itertools.zip_longest(*[iter(lines)]*2, fillvalue=None)]
+
+def read_range(file_name, offset, length):
+    return range_records(range_bytes(file_name, offset, length))
+
+def load_records(chunk):
+    # Chunks are either a list of path/ACL pairs or a (file, offset, length) byte range
+    if isinstance(chunk, tuple):
+        return read_range(*chunk)
+    return chunk
+
+def spill_file(spill_dir, index):
+    return os.path.join(spill_dir, f'chunk-{index:06d}.pkl')
+
+def chunk_bytes(chunk):
+    # Size of a chunk spec in the export (or on disk once spilled), for progress and ETAs
+    if isinstance(chunk, acl.Chunk):
+        return 0
+    if isinstance(chunk, tuple):
+        return chunk[2]
+    if isinstance(chunk, str):
+        return os.path.getsize(chunk)
+    return sum(2 * (len(line[0]) + len(line[1] or '') + 4) for line in chunk)
+
+def spill_task_bytes(passed):
+    return chunk_bytes(passed[0])
+
+def load_chunk(chunk):
+    # A string is a chunk that was already parsed and spilled to disk by parse_and_spill
+    if isinstance(chunk, acl.Chunk):
+        return chunk
+    if isinstance(chunk, str):
+        with open(chunk, 'rb') as spill:
+            return pickle.load(spill)
+    return process_chunk_lines(load_records(chunk))
+
+def imap_window(pool, func, tasks, max_pending, size=None):
+    # Like pool.imap but never pulls more than max_pending tasks ahead of the consumer.
+    # size gives the bytes each task covers, which are reported as progress once it is done.
+    pending = collections.deque()
+    for task in tasks:
+        pending.append((pool.apply_async(func, (task,)), size(task) if size else 0))
+        if len(pending) >= max_pending:
+            result, task_bytes = pending.popleft()
+            yield result.get()
+            instrument.advance(size=task_bytes)
+    while pending:
+        result, task_bytes = pending.popleft()
+        yield result.get()
+        instrument.advance(size=task_bytes)
 
 def process_chunk_lines(chunk):
-    chunk_file_list = []
+    file_chunk = acl.Chunk()
     for line in chunk:
-        sacl = ''
-        pline = line[1]
-        if 'S:' in line[1]:
-            sacl_split = pline.split('S:')
-            sacl = 'S:' + sacl_split[1]
-            pline = sacl_split[0]
-        fperms = pline.split('(')
-        file_permissions = []
-        for i in fperms[1:]:
-            file_permissions.append('(' + i)
-        file_line = [line[0], fperms[0], file_permissions, sacl]
-        chunk_file_list.append(file_line)
-    return chunk_file_list
+        file_chunk.add(line[0], line[1])
+    return file_chunk
 
 def process_sids(file_chunk):
-    sid_chunk = set()
-    for file in file_chunk:
-        for perm in file[2]:
-            sid = perm.split(';;;')[1][:-1]
-            if sid.startswith('S-1-5-21-'):
-                sid_chunk.add(sid)
-    return sid_chunk
+    return file_chunk.sid_counts()
+
+def chunk_sids(chunk):
+    # Discovery only needs the SIDs, so the ACL lines are scanned for them instead of parsed.
+    # Byte ranges start on a path line, so every second line is an ACL and nothing needs pairing.
+    if isinstance(chunk, tuple):
+        file_name, offset, length = chunk
+        with open(file_name, "rb") as acl_file, mmap.mmap(acl_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            lines = mm[offset:offset + length].decode('utf-16-le').split('\n')
+        if lines and not lines[-1]:
+            lines.pop()
+        return acl.scan_sids(lines[1::2]), (len(lines) + 1) // 2
+    records = load_records(chunk)
+    return acl.scan_sids(line[1] for line in records), len(records)
 
 def build_chunk(file_lines, num_workers):
     print("Build and chunk list")
     paired_lines = [list(pair) for pair in itertools.zip_longest(*[iter(file_lines)]*2, fillvalue=None)]
-    chunk_size = len(paired_lines) // num_workers
-    chunked_lines = list(chunkify(paired_lines, chunk_size))
-    return chunked_lines, chunk_size
+    total_aces = sum(1 + (pair[1].count('(') if pair[1] else 0) for pair in paired_lines)
+    task_aces = max(1, min(TASK_ACES, total_aces // (num_workers * TASKS_PER_WORKER)))
+    chunked_lines = list(size_chunks(paired_lines, task_aces, len(paired_lines)))
+    return chunked_lines
 
-def isolate_permissions(chunked_lines, pool, chunk_size):
+def isolate_permissions(chunked_lines, pool):
     print("Isolate permissions")
-    file_list_chunks = pool.map(process_chunk_lines, chunked_lines)
-    file_list = [item for sublist in file_list_chunks for item in sublist]
-    chunked_files = list(chunkify(file_list, chunk_size))
+    chunked_files = []
+    for file_chunk in pool.imap(process_chunk_lines, chunked_lines):
+        chunked_files.append(file_chunk)
+        instrument.advance(len(file_chunk))
     return chunked_files
 
 def find_unique_sids(chunked_files, pool):
     print("Find unique SIDs")
-    sid_sets = pool.map(process_sids, chunked_files)
-    sids = set()
-    for chunk in sid_sets:
-        for sid in chunk:
-            sids.add(sid)
+    sid_counts = pool.imap(process_sids, chunked_files)
+    sids = collections.Counter()
+    for file_chunk, chunk in zip(chunked_files, sid_counts):
+        sids.update(chunk)
+        instrument.advance(len(file_chunk))
     return sids
 
 def identify_domains(sid_users):
@@ -115,28 +305,153 @@ def make_sid_pairs(matched_users, matched_groups):
     paired_sids.update({group[0]:group[6] for group in matched_groups})
     return paired_sids
     
-def match_chunk_perms(passed):
-    chunk, sid_pairs = passed
-    new_perms=[]
-    for file in chunk:
-        new_file_perms = []
-        current_sids = set()
-        for item in file[2]:
-            sid = item.split(';;;')[1][:-1]
-            if sid.startswith('S-1-5-21-'):
-                current_sids.add(sid)
-        for item in file[2]:
-            new_file_perms.append(item)
-            perm_string = item.split(';;;')
-            old_sid = perm_string[1][:-1]
-            if old_sid.startswith('S-1-5-21-'):
-                if old_sid in sid_pairs: 
-                    if sid_pairs[old_sid] not in current_sids:
-                        new_file_perms.append(f'{perm_string[0]};;;{sid_pairs[old_sid]})')
-        new_perms.append(f'{file[0]}\n{file[1]}{''.join(new_file_perms)}{file[3]}\n')
-    return new_perms
-
-def match_perms(chunked_files, sid_pairs, pool):
+def install_sid_pairs(pairs, delta_file=None, shards=None):
+    # Pool initializer for the rewrite workers. pairs is a dict or a frozen acl.SidMap,
+    # shards is a (part directory, shard count, subtree depth) tuple
+    global sid_pairs, delta_index, shard_spec
+    sid_pairs = pairs
+    delta_index = delta.Index(delta_file) if delta_file else None
+    shard_spec = shards
+    acl_cache.clear()
+
+def rewrite_pool(num_workers, paired_sids, delta_file=None, shards=None):
+    return instrument.pool(num_workers, install_sid_pairs, (acl.SidMap(paired_sids), delta_file, shards), 'rewrite')
+
+def encode_records(texts):
+    # Restore text is encoded once per chunk (or shard part) in the worker. One bulk encode is
+    # faster than encoding, or passing through the original bytes of, each record on its own.
+    return ''.join(texts).encode('utf-16-le')
+
+def original_output(chunk, data):
+    # The export bytes of an unchanged chunk are its output as they stand, provided they use the
+    # same line endings, have no byte order mark and nothing was stripped from a line when parsing
+    line_end = LINE_END.encode('utf-16-le')
+    text_length = sum(map(len, chunk.paths)) + sum(map(len, map(chunk.acl_texts.__getitem__, chunk.acl_ids)))
+    if len(data) != 2 * (text_length + 2 * len(chunk) * len(LINE_END)) or data.count(line_end) != 2 * len(chunk):
+        return None
+    if not data.endswith(line_end) or data.startswith(codecs.BOM_UTF16_LE):
+        return None
+    return data
+
+def match_chunk_perms(chunk, original=None, export=0):
+    # original is the chunk's bytes in the export when it came from a byte range, export the
+    # position of the export the chunk belongs to
+    targets = chunk.sids.translate(sid_pairs)
+    new_acls = []
+    rewrites = 0
+    for acl_id, acl_text in enumerate(chunk.acl_texts):
+        new_acl = acl_cache.get(acl_text)
+        if new_acl is None:
+            if len(acl_cache) >= ACL_CACHE_LIMIT:
+                acl_cache.clear()
+            new_acl = acl_cache[acl_text] = chunk.rewrite(acl_id, targets)
+            rewrites += 1
+        new_acls.append(new_acl)
+    if original is not None and not delta_index and not shard_spec and new_acls == chunk.acl_texts:
+        original = original_output(chunk, original)
+        if original is not None:
+            return original, len(chunk) - rewrites, len(chunk), len(chunk)
+    records = zip(chunk.paths, chunk.acl_ids)
+    if delta_index:
+        # Only records that changed since the previous export and still need new ACEs
+        records = [(path, acl_id) for path, acl_id in records
+                   if new_acls[acl_id] != chunk.acl_texts[acl_id] and delta_index.changed(path, chunk.acl_texts[acl_id], export)]
+    if shard_spec:
+        new_perms = shard.write_parts(((path, f'{path}{LINE_END}{new_acls[acl_id]}{LINE_END}') for path, acl_id in records), *shard_spec)
+        return new_perms, len(chunk) - rewrites, len(chunk), sum(part[2] for part in new_perms)
+    texts = [f'{path}{LINE_END}{new_acls[acl_id]}{LINE_END}' for path, acl_id in records]
+    return encode_records(texts), len(chunk) - rewrites, len(chunk), len(texts)
+
+def report_cache(hits, records):
+    if records:
+        print(f'ACL cache: {hits} of {records} records reused a rewritten ACL ({hits / records:.1%} hit rate)')
+
+def chunk_perms(chunk, export=0):
+    # Byte ranges keep their raw bytes so a chunk the rewrite leaves alone is passed through
+    if isinstance(chunk, tuple):
+        data = range_bytes(*chunk)
+        return match_chunk_perms(process_chunk_lines(range_records(data)), data, export)
+    return match_chunk_perms(load_chunk(chunk), export=export)
+
+def collect_perms(results):
+    # Yields rewritten chunks in export order as soon as each one and its predecessors are done
+    total_hits = 0
+    records = 0
+    written = 0
+    for chunk, hits, chunk_records, chunk_written in results:
+        total_hits += hits
+        records += chunk_records
+        written += chunk_written
+        instrument.advance(chunk_records)
+        yield chunk
+    report_cache(total_hits, records)
+    if written != records:
+        print(f'Delta: {written} of {records} records changed since the previous export and need new permissions')
+
+def write_restore(new_perms, file_name):
+    # The workers hand over encoded blocks, so they go straight to a large binary buffer
+    with open(file_name, "wb", buffering=OUTPUT_BUFFER) as new_acl_file:
+        new_acl_file.write(codecs.BOM_UTF16_LE)
+        new_acl_file.writelines(new_perms)
+
+def fingerprint_chunk(task):
+    export, chunk = task
+    return delta.fingerprint_records(load_records(chunk), export)
+
+def fingerprint_exports(sources, index_file, pool, max_pending):
+    # sources holds the chunks of each export, the position of an export keys its paths in the index
+    print('Fingerprint exports')
+    tasks = ((index, chunk) for index, chunks in enumerate(sources) for chunk in chunks)
+    return delta.build_index(imap_window(pool, fingerprint_chunk, tasks, max_pending, indexed_task_bytes), index_file)
+
+def match_perms(chunked_files, pool):
     print('Creating new permission file.')
-    new_file_perms = pool.map(match_chunk_perms, [(chunk, sid_pairs) for chunk in chunked_files])
-    return new_file_perms
\ No newline at end of file
+    return collect_perms(pool.imap(match_chunk_perms, chunked_files))
+
+def stream_unique_sids(chunks, pool, max_pending):
+    print("Find unique SIDs (streaming)")
+    sids = collections.Counter()
+    for sid_chunk, records in imap_window(pool, chunk_sids, chunks, max_pending, chunk_bytes):
+        sids.update(sid_chunk)
+        instrument.advance(records)
+    return sids
+
+def parse_and_spill(passed):
+    chunk, file_name = passed
+    file_chunk = process_chunk_lines(load_records(chunk))
+    with open(file_name, 'wb') as spill:
+        pickle.dump(file_chunk, spill, protocol=pickle.HIGHEST_PROTOCOL)
+    return process_sids(file_chunk), len(file_chunk)
+
+def fused_unique_sids(chunks, pool, spill_dir, max_pending):
+    print("Parse and find unique SIDs (fused)")
+    sids = collections.Counter()
+    tasks = ((chunk, spill_file(spill_dir, index)) for index, chunk in enumerate(chunks))
+    spilled = 0
+    for sid_chunk, records in imap_window(pool, parse_and_spill, tasks, max_pending, spill_task_bytes):
+        sids.update(sid_chunk)
+        instrument.advance(records)
+        spilled += 1
+    return sids, [spill_file(spill_dir, index) for index in range(spilled)]
+
+def stream_perms(chunks, pool, max_pending):
+    print('Creating new permission file (streaming).')
+    return collect_perms(imap_window(pool, chunk_perms, chunks, max_pending, chunk_bytes))
+
+def indexed_chunk_perms(task):
+    index, chunk = task
+    return index, chunk_perms(chunk, index)
+
+def indexed_task_bytes(task):
+    return chunk_bytes(task[1])
+
+def export_perms(sources, pool, max_pending):
+    # Rewrites the chunks of several exports through one window, so the pool keeps working across
+    # the end of one export and the start of the next. Yields (export index, rewritten chunks) in
+    # export order, each export's chunks have to be consumed before moving on. Exports without
+    # records are skipped.
+    print('Creating new permission files.')
+    tasks = ((index, chunk) for index, chunks in enumerate(sources) for chunk in chunks)
+    results = imap_window(pool, indexed_chunk_perms, tasks, max_pending, indexed_task_bytes)
+    for index, group in itertools.groupby(results, key=operator.itemgetter(0)):
+        yield index, collect_perms(result for result_index, result in group)
@@ -3,108 +3,395 @@ Script: permissions.py
 Description: Replicate permissions from one domain to another using text files from/to icacls
 
 Usage:
-    python permissions.py <icacls export file>
+    python permissions.py <icacls export file> [<icacls export file> ...] [options]
+    python permissions.py --help
 
 Modules:
     - parse.py: Parses data for use by other functions
+    - acl.py: Compact interned representation of the records in an icacls export
     - correlate.py: Correlates objects between domains
-    - ldap.py: Connects via LDAP to pull groups
-    - w32.py: Uses Win32 API to resolve/get SIDs and get users
+    - ldap.py: Connects via LDAP to pull users and groups
+    - w32.py: Uses Win32 API to resolve SIDs and account names
+    - resolve.py: Resolves SIDs and account names concurrently through a pluggable backend
+    - cache.py: Persistent cache of SID resolutions and directory snapshots shared between runs
+    - plan.py: Saves and loads the SID mapping decisions of a run so later runs can reuse them
+    - delta.py: Fingerprints icacls exports so a later export can be reduced to the records that changed
+    - shard.py: Splits the restore output into shards along directory subtrees for parallel icacls restores
+    - instrument.py: Records stage timings, throughput, memory, DC round trips and worker profiles of a run
+    - checkpoint.py: Persists the results of each pipeline stage so an interrupted run can resume where it stopped
 
 Author: Andrew Collings
 Created: 2025-01-16
-Updated: 2025-02-11
+Updated: 2026-10-18
 License: MIT
 """
 
 import multiprocessing
+import argparse
 import questionary
-import sys, os
+import os
+import collections
+import tempfile, shutil
 import getpass
-import parse, w32, ldap, correlate
+import parse, w32, ldap, correlate, cache, plan, delta, shard, instrument, resolve, checkpoint
 
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description='Replicate permissions from one domain to another using text files from/to icacls')
+    parser.add_argument('exports', nargs='+', help='icacls export files, plain or gzip/zstd compressed (relative to your current path)')
+    parser.add_argument('--stream', action='store_true', help='stream records through the pipeline instead of loading the whole export into memory')
+    parser.add_argument('--window', type=int, default=10000, help='records per streamed chunk (default: 10000)')
+    parser.add_argument('--mmap', action='store_true', help='have workers memory-map the export and parse their own byte ranges')
+    parser.add_argument('--range-mb', type=int, default=32, help='size of each byte range in MB when using --mmap (default: 32)')
+    parser.add_argument('--fused', action='store_true', help='parse each chunk once in the workers and spill it to disk so the ACL data never returns to this process')
+    parser.add_argument('--spill-dir', help='directory for the chunks spilled by --fused (default: system temp directory)')
+    parser.add_argument('--cache', default=cache.DEFAULT_PATH, help=f'SID and directory cache file (default: {cache.DEFAULT_PATH})')
+    parser.add_argument('--cache-ttl', type=float, default=cache.DEFAULT_TTL, help=f'hours before cached entries are looked up again (default: {cache.DEFAULT_TTL})')
+    parser.add_argument('--no-cache', action='store_true', help='always query the domain controllers')
+    parser.add_argument('--warm-cache', action='store_true', help='resolve SIDs and fetch the directory into the cache, then exit')
+    parser.add_argument('--plan', help='mapping plan from an earlier run, only SIDs it does not cover are correlated')
+    parser.add_argument('--save-plan', help='save the SID pairs and correlation decisions of this run as a mapping plan')
+    parser.add_argument('--batch', action='store_true', help='do not prompt, rewrite using only the SID pairs in --plan')
+    parser.add_argument('--output', help='output filename, or with several exports the directory for their outputs (otherwise you are asked)')
+    parser.add_argument('--previous', nargs='+', help='earlier exports of the same trees in the same order, or a fingerprint file saved from them, only records that changed since are written')
+    parser.add_argument('--save-fingerprints', help='save a fingerprint file of these exports for a later --previous run')
+    parser.add_argument('--shards', type=int, help='split the output into this many shards that can be restored in parallel')
+    parser.add_argument('--shard-depth', type=int, default=2, help='path depth of the subtrees that are kept together in one shard (default: 2)')
+    parser.add_argument('--report', help='save a JSON report of stage timings, throughput, memory and DC round trips')
+    parser.add_argument('--profile', help='save cProfile output of this process and every worker to this directory')
+    parser.add_argument('--no-progress', action='store_true', help='do not show live progress')
+    parser.add_argument('--checkpoint', help='save the result of each stage to this directory and resume from it if the run is restarted')
+    args = parser.parse_args()
+    if args.batch and not (args.plan and args.output):
+        parser.error('--batch needs --plan and --output')
+
+    instrument.start(progress=False if args.no_progress else None, profile_dir=args.profile)
     num_workers = multiprocessing.cpu_count()
-    pool = multiprocessing.Pool(num_workers)
-
-    def load_file():
-        print("Load File")
-        with open(sys.argv[1], "r", encoding="utf-16-le") as acl_file:
-            file_lines = [line.lstrip("\ufeff").strip() for line in acl_file]
-        return file_lines
-
-    def get_dom_creds(unique_domains):
-        dc_fqdns = {}
-        for domain in sorted(unique_domains):
-            fqdn = input(f"Please enter the DC FQDN for the domain {domain}: ")
-            dom_admin = input(f"Please enter a domain admin username for the domain {domain}: ")
-            admin_pass = getpass.getpass(f"Please enter the password for {dom_admin}: ")
-            dc_fqdns.update({domain:[fqdn, dom_admin, admin_pass]})
-        return dc_fqdns
-        
-    #Load file
+    max_pending = num_workers * 2
+    pool = instrument.pool(num_workers, name='parse')
+
+    # Work directories are removed on every way out, including the exits at prompts and errors
+    spill_root = None
+    delta_dir = None
+    shard_dir = None
     try:
-        file_lines = load_file()
-    except:
-        print('Please launch the script with an icacls export file (relative to your current path) as an argument.')
-        exit()
-    chunked_lines, chunk_size = parse.build_chunk(file_lines, num_workers)
-    chunked_files = parse.isolate_permissions(chunked_lines, pool, chunk_size)
-
-    #Isolate SIDs
-    sids = parse.find_unique_sids(chunked_files, pool)
-    first_pass_sids = w32.resolve_sids(sids)
-    unique_domains = parse.identify_domains(first_pass_sids)
-    print('The following domains have been identified from the permission file:')
-    print(''.join(f'{i}   ' for i in unique_domains), end='')
-    manual_target_domain = input('\nPlease enter the NetBIOS name for the target domain if not listed above (otherwise leave blank) then hit Enter: ').upper()
-    if manual_target_domain: unique_domains.add(manual_target_domain)
-
-    #Domain details
-    dc_fqdns = get_dom_creds(unique_domains)
-    domain_choices = list(dc_fqdns.keys())
-    template_domain = questionary.select("Please select the domain to use as a permission template: ", domain_choices).ask()
-    domain_choices.remove(template_domain)
-    target_domain = questionary.select("Please select the target domain to add permission: ", domain_choices).ask()
-
-    #Get users and groups
-    domain_users = w32.get_domain_users(dc_fqdns)
-    domain_groups = ldap.get_groups(dc_fqdns)
-
-    #Resolve SIDs
-    resolved_sids, unresolved_sids = parse.separate_unresolved(first_pass_sids)
-    resolved_groups, still_unresolved = parse.second_pass_resolve(unresolved_sids, domain_groups)
-    if resolved_groups:
-        resolved_sids += resolved_groups
-    
-    identified_users, identified_groups = parse.separate_users_groups(resolved_sids)
-    
-    #Correlate users
-    filtered_users = [user for user in identified_users if user[3] == template_domain]
-    skip_disabled_users = questionary.confirm('Would you like to skip matching disabled users?').ask()
-    if skip_disabled_users:
-        filtered_users, disabled_users = w32.skip_disabled(filtered_users, domain_users, template_domain)
-    matched_users = correlate.users(filtered_users, domain_users, template_domain, target_domain)
-    matched_users_sids = w32.get_user_sid(matched_users)
-
-    #Correlate groups
-    filtered_groups = [group for group in identified_groups if group[3] == template_domain]
-    matched_groups = correlate.groups(filtered_groups, domain_groups, target_domain)
-    
-    #Pair SIDs
-    print('Pairing SIDs')
-    paired_sids = parse.make_sid_pairs(matched_users, matched_groups)
-
-    #Write new permissions
-    new_perms = parse.match_perms(chunked_files, paired_sids, pool)
-    pool.close()
-    pool.join()
-    print(f'The output file will be created in your current working directory which is:\n{os.getcwd()}')
-    file_name = input('Please enter a filename for the output: ')
-    with open(file_name, "w", encoding="utf-16-le") as new_acl_file:
-        new_acl_file.write('\ufeff')
-        for chunk in new_perms:
-                new_acl_file.writelines(chunk)
-    print('Done! Please use icacls restore to apply.')
+        def load_file(export):
+            print("Load File")
+            with instrument.stage('load_file') as stage, parse.open_export(export) as acl_file:
+                file_lines = [line.lstrip("\ufeff").strip() for line in acl_file]
+                stage.items = len(file_lines) // 2
+            return file_lines
+
+        def get_dom_creds(unique_domains):
+            # Domains with a fresh snapshot need no DC, the snapshot is kept so it is still used
+            # if it expires while the remaining questions are answered
+            dc_fqdns = {}
+            snapshots = {}
+            for domain in sorted(unique_domains):
+                snapshot = directory_cache.get_snapshot(domain) if directory_cache else None
+                if snapshot:
+                    snapshots[domain] = snapshot
+                    dc_fqdns.update({domain:[None, None, None]})
+                    continue
+                fqdn = input(f"Please enter the DC FQDN for the domain {domain}: ")
+                dom_admin = input(f"Please enter a domain admin username for the domain {domain}: ")
+                admin_pass = getpass.getpass(f"Please enter the password for {dom_admin}: ")
+                dc_fqdns.update({domain:[fqdn, dom_admin, admin_pass]})
+            return dc_fqdns, snapshots
+
+        def resume(stage):
+            return run_checkpoint is not None and run_checkpoint.has(stage)
+
+        def correlate_sids(sids):
+            if resume('resolved'):
+                first_pass_sids = checkpoint.restore_binary_sids(run_checkpoint.load('resolved'), sid_resolver)
+            else:
+                with instrument.stage('resolve_sids', len(sids), unit='SIDs'):
+                    first_pass_sids = w32.resolve_sids(sids, sid_resolver)
+                if run_checkpoint:
+                    run_checkpoint.save('resolved', checkpoint.strip_binary_sids(first_pass_sids))
+
+            if resume('directory'):
+                directory = run_checkpoint.load('directory')
+                template_domain = directory['template_domain']
+                target_domain = directory['target_domain']
+                domain_users = directory['users']
+                domain_groups = directory['groups']
+                user_indexes = {}
+                group_indexes = {}
+                for domain in domain_users:
+                    user_indexes[domain], group_indexes[domain] = ldap.index_directory(domain_users[domain], domain_groups[domain])
+            else:
+                unique_domains = parse.identify_domains(first_pass_sids)
+                if mapping_plan:
+                    unique_domains.update([mapping_plan['template_domain'], mapping_plan['target_domain']])
+                print('The following domains have been identified from the permission file:')
+                print(''.join(f'{i}   ' for i in unique_domains), end='')
+                manual_target_domain = input('\nPlease enter the NetBIOS name for the target domain if not listed above (otherwise leave blank) then hit Enter: ').upper()
+                if manual_target_domain: unique_domains.add(manual_target_domain)
+
+                #Domain details
+                dc_fqdns, snapshots = get_dom_creds(unique_domains)
+                if args.warm_cache:
+                    with instrument.stage('get_directory', unit='entries'):
+                        ldap.get_directory(dc_fqdns, cache=directory_cache, snapshots=snapshots)
+                    print('Cache warmed.')
+                    instrument.finish(args.report)
+                    exit()
+                if mapping_plan:
+                    template_domain = mapping_plan['template_domain']
+                    target_domain = mapping_plan['target_domain']
+                else:
+                    domain_choices = list(dc_fqdns.keys())
+                    template_domain = questionary.select("Please select the domain to use as a permission template: ", domain_choices).ask()
+                    domain_choices.remove(template_domain)
+                    target_domain = questionary.select("Please select the target domain to add permission: ", domain_choices).ask()
+
+                #Get users and groups
+                with instrument.stage('get_directory', unit='entries'):
+                    domain_users, domain_groups, user_indexes, group_indexes = ldap.get_directory(dc_fqdns, cache=directory_cache, snapshots=snapshots)
+                if run_checkpoint:
+                    run_checkpoint.save('directory', {'template_domain': template_domain, 'target_domain': target_domain,
+                                                      'users': domain_users, 'groups': domain_groups})
+
+            #Resolve SIDs
+            resolved_sids, unresolved_sids = parse.separate_unresolved(first_pass_sids)
+            with instrument.stage('second_pass_resolve', len(unresolved_sids), unit='SIDs'):
+                resolved_groups, still_unresolved = parse.second_pass_resolve(unresolved_sids, domain_groups)
+            if resolved_groups:
+                resolved_sids += resolved_groups
+        
+            identified_users, identified_groups = parse.separate_users_groups(resolved_sids)
+        
+            #Correlate users
+            if resume('users'):
+                user_choices = run_checkpoint.load('users')
+                skip_disabled_users = user_choices['skip_disabled']
+                matched_users = checkpoint.restore_binary_sids(user_choices['matched_users'], sid_resolver)
+            else:
+                # Users and groups on the most ACEs are asked about first
+                filtered_users = sorted((user for user in identified_users if user[3] == template_domain), key=lambda user: -sids[user[0]])
+                if mapping_plan:
+                    skip_disabled_users = mapping_plan['skip_disabled']
+                else:
+                    skip_disabled_users = questionary.confirm('Would you like to skip matching disabled users?').ask()
+                if skip_disabled_users:
+                    with instrument.stage('skip_disabled', len(filtered_users), unit='users'):
+                        filtered_users, disabled_users = w32.skip_disabled(filtered_users, domain_users, template_domain)
+                with instrument.stage('correlate_users', len(filtered_users), unit='users', interactive=True):
+                    matched_users = correlate.users(filtered_users, domain_users, template_domain, target_domain, user_indexes[target_domain])
+                name_resolver = resolve.TimedResolver(w32.Win32Resolver())
+                if directory_cache:
+                    name_resolver = cache.CachedResolver(name_resolver, directory_cache, target_domain)
+                with instrument.stage('get_user_sid', len(matched_users), unit='users'):
+                    matched_users_sids = w32.get_user_sid(matched_users, name_resolver)
+                if run_checkpoint:
+                    run_checkpoint.save('users', {'skip_disabled': skip_disabled_users, 'matched_users': checkpoint.strip_binary_sids(matched_users)})
+
+            #Correlate groups
+            filtered_groups = sorted((group for group in identified_groups if group[3] == template_domain), key=lambda group: -sids[group[0]])
+            if mapping_plan:
+                group_modifier = mapping_plan['group_suffix']
+            else:
+                group_modifier = input('If the groups in the target domain have a common suffix please enter it (including any spaces). Otherwise, just press Enter: ')
+            with instrument.stage('correlate_groups', len(filtered_groups), unit='groups', interactive=True):
+                matched_groups = correlate.groups(filtered_groups, domain_groups, target_domain, group_indexes[target_domain], group_modifier)
+            # None marks a lookup that failed rather than an account that does not exist
+            failed = {item[0] for item in still_unresolved if item[2] is None} | {user[0] for user in matched_users if user[8] is None}
+            if failed:
+                print(f'{len(failed)} SIDs could not be looked up, they are left out of the mapping plan so a later run tries them again')
+            return plan.build(template_domain, target_domain, group_modifier, skip_disabled_users, matched_users, matched_groups, sids, failed)
+
+        def export_chunks(index):
+            # Records of one export for a pass that parses them again, from its byte ranges when it has them
+            kind, chunks = sources[index]
+            if kind == 'ranges':
+                return chunks
+            return parse.stream_chunks(exports[index], args.window)
+
+        def file_chunks(export):
+            if parse.compression(export):
+                return parse.stream_chunks(export, args.window)
+            return parse.split_ranges(export, args.range_mb * 1024 * 1024)
+
+        def spill_dir(index):
+            if run_checkpoint:
+                return run_checkpoint.records_dir(index)
+            export_spill_dir = os.path.join(spill_root, f'{index:03d}')
+            os.makedirs(export_spill_dir, exist_ok=True)
+            return export_spill_dir
+
+        def write_output(file_name, new_perms):
+            if shard_dir:
+                shard.write_shards(new_perms, file_name, args.shard_depth)
+            else:
+                parse.write_restore(new_perms, file_name)
+
+        exports = args.exports
+        for export in exports:
+            if not os.path.isfile(export):
+                print(f'{export} was not found. Please launch the script with icacls export files (relative to your current path) as arguments.')
+                exit()
+        # Fingerprints are matched to exports by position, so each export needs its own earlier export
+        if args.previous and len(args.previous) != len(exports) and not (len(args.previous) == 1 and os.path.isfile(args.previous[0]) and delta.is_index(args.previous[0])):
+            print(f'--previous needs one earlier export for each of the {len(exports)} exports, in the same order, or a fingerprint file saved from them.')
+            exit()
+        mapping_plan = plan.load(args.plan) if args.plan else None
+        directory_cache = None if args.no_cache else cache.Cache(args.cache, args.cache_ttl)
+        sid_resolver = resolve.TimedResolver(w32.Win32Resolver())
+        if directory_cache:
+            sid_resolver = cache.CachedResolver(sid_resolver, directory_cache)
+        run_checkpoint = None
+        if args.checkpoint:
+            try:
+                run_checkpoint = checkpoint.Checkpoint(args.checkpoint, exports)
+            except (OSError, ValueError) as e:
+                print(f'Cannot use the checkpoint: {e}')
+                exit()
+            if run_checkpoint.resumed():
+                print(f'Resuming from {args.checkpoint}, the last saved stage is "{run_checkpoint.resumed()}"')
+        spill_root = tempfile.mkdtemp(prefix='permissions-', dir=args.spill_dir) if args.fused and not run_checkpoint else None
+
+        #Load files
+        if resume('sids'):
+            sources = run_checkpoint.load_records()
+            discovered = run_checkpoint.load('sids')
+            sids = collections.Counter(discovered['sids'])
+            export_records = discovered['records']
+        elif args.stream or args.mmap or args.fused or run_checkpoint:
+            # Each export keeps what the rewrite needs to read its records again: byte ranges, spilled
+            # chunks, or nothing when it is streamed from the file a second time. A checkpoint always
+            # comes this way because the in-memory records cannot be saved.
+            sources = []
+            sids = collections.Counter()
+            export_sizes = [parse.export_size(export) for export in exports]
+            with instrument.stage('find_unique_sids', total_bytes=None if None in export_sizes else sum(export_sizes)) as stage:
+                for index, export in enumerate(exports):
+                    # Compressed exports cannot be memory-mapped, so they are always streamed
+                    if args.mmap and not parse.compression(export):
+                        kind, chunks = 'ranges', parse.split_ranges(export, args.range_mb * 1024 * 1024)
+                    else:
+                        kind, chunks = 'stream', parse.stream_chunks(export, args.window)
+                    # Parsed records must outlive the run, so a checkpoint spills anything it cannot reread by range
+                    if args.fused or (run_checkpoint and kind == 'stream'):
+                        export_sids, spill_files = parse.fused_unique_sids(chunks, pool, spill_dir(index), max_pending)
+                        sources.append(('spill', spill_files))
+                    else:
+                        export_sids = parse.stream_unique_sids(chunks, pool, max_pending)
+                        sources.append((kind, chunks if kind == 'ranges' else None))
+                    sids.update(export_sids)
+            export_records = stage.items
+            if run_checkpoint:
+                run_checkpoint.save_records(sources)
+                run_checkpoint.save('sids', {'sids': dict(sids), 'records': export_records})
+        else:
+            sources = []
+            sids = collections.Counter()
+            export_records = 0
+            for export in exports:
+                try:
+                    file_lines = load_file(export)
+                except:
+                    print(f'{export} could not be read. Please launch the script with icacls export files (relative to your current path) as arguments.')
+                    exit()
+                records = (len(file_lines) + 1) // 2
+                with instrument.stage('build_chunk') as stage:
+                    chunked_lines = parse.build_chunk(file_lines, num_workers)
+                    stage.items = records
+                del file_lines
+                with instrument.stage('isolate_permissions', records):
+                    chunked_files = parse.isolate_permissions(chunked_lines, pool)
+                del chunked_lines
+
+                #Isolate SIDs
+                with instrument.stage('find_unique_sids', records):
+                    sids.update(parse.find_unique_sids(chunked_files, pool))
+                sources.append(('chunks', chunked_files))
+                export_records += records
+        if resume('plan'):
+            mapping_plan = run_checkpoint.load('plan')
+        #Correlate SIDs not covered by the mapping plan
+        new_sids = plan.uncovered(mapping_plan, sids) if mapping_plan else sids
+        if mapping_plan:
+            print(f'{len(sids) - len(new_sids)} SIDs are covered by the mapping plan, {len(new_sids)} are not')
+        if args.batch:
+            if new_sids:
+                print('The following SIDs are not covered by the mapping plan and will not have permissions created:')
+                for i, (sid, count) in enumerate(new_sids.most_common()):
+                    print(f'{sid} ({count})', end='   ')
+                    if (i + 1) % 5 == 0:
+                        print()
+                print()
+        elif new_sids or args.warm_cache or not mapping_plan:
+            new_plan = correlate_sids(new_sids)
+            mapping_plan = plan.merge(mapping_plan, new_plan) if mapping_plan else new_plan
+            if args.save_plan:
+                plan.save(mapping_plan, args.save_plan)
+        if run_checkpoint:
+            run_checkpoint.save('plan', mapping_plan)
+
+        #Pair SIDs
+        print('Pairing SIDs')
+        paired_sids = mapping_plan['sid_pairs']
+
+        #Write new permissions
+        delta_file = None
+        if args.previous:
+            if len(args.previous) == 1 and delta.is_index(args.previous[0]):
+                delta_file = args.previous[0]
+            else:
+                delta_dir = tempfile.mkdtemp(prefix='permissions-')
+                delta_file = os.path.join(delta_dir, 'previous.fp')
+                previous_sizes = [parse.export_size(previous) for previous in args.previous]
+                with instrument.stage('fingerprint_previous', total_bytes=None if None in previous_sizes else sum(previous_sizes)):
+                    parse.fingerprint_exports([file_chunks(previous) for previous in args.previous], delta_file, pool, max_pending)
+        pool.close()
+        pool.join()
+        if args.shards:
+            shard_dir = tempfile.mkdtemp(prefix='permissions-shards-', dir=args.spill_dir)
+        pool = parse.rewrite_pool(num_workers, paired_sids, delta_file, (shard_dir, args.shards, args.shard_depth) if shard_dir else None)
+        if len(exports) == 1:
+            if args.output:
+                file_names = [args.output]
+            else:
+                print(f'The output file will be created in your current working directory which is:\n{os.getcwd()}')
+                file_names = [input('Please enter a filename for the output: ')]
+        else:
+            output_dir = args.output
+            if not output_dir:
+                print(f'The output files will be created in your current working directory which is:\n{os.getcwd()}')
+                output_dir = input('Please enter a directory for the output files (leave blank for the current directory): ') or '.'
+            os.makedirs(output_dir, exist_ok=True)
+            file_names = []
+            for index, export in enumerate(exports):
+                file_name = os.path.join(output_dir, f'{parse.export_stem(export)}.{mapping_plan["target_domain"]}.txt')
+                if file_name in file_names:
+                    file_name = os.path.join(output_dir, f'{parse.export_stem(export)}-{index}.{mapping_plan["target_domain"]}.txt')
+                file_names.append(file_name)
+        rewrite_sources = [parse.stream_chunks(export, args.window) if kind == 'stream' else chunks for export, (kind, chunks) in zip(exports, sources)]
+        # The rewrite is lazy, so it runs while the outputs are written. Every export goes through
+        # the same pool window, so small exports are rewritten side by side.
+        with instrument.stage('rewrite_and_write', export_records):
+            written = set()
+            for index, new_perms in parse.export_perms(rewrite_sources, pool, max_pending):
+                if len(exports) > 1:
+                    print(f'Writing {file_names[index]}')
+                write_output(file_names[index], new_perms)
+                written.add(index)
+            for index in sorted(set(range(len(exports))) - written):
+                write_output(file_names[index], [])
+        if args.save_fingerprints:
+            with instrument.stage('save_fingerprints', export_records):
+                parse.fingerprint_exports([export_chunks(index) for index in range(len(exports))], args.save_fingerprints, pool, max_pending)
+        pool.close()
+        pool.join()
+        if run_checkpoint:
+            print(f'The checkpoint in {args.checkpoint} is kept so the output can be written again, delete it once it is no longer needed.')
+        instrument.finish(args.report)
+        print('Done! Please use icacls restore to apply.')
+    finally:
+        pool.terminate()
+        for work_dir in (spill_root, delta_dir, shard_dir):
+            if work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
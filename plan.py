@@ -0,0 +1,57 @@
+"""
+Module: plan.py
+Description: Saves and loads the SID mapping decisions of a run so later runs can reuse them
+
+Author: Andrew Collings
+Created: 2026-10-18
+Updated: 2026-10-18
+License: MIT
+"""
+
+import collections
+import datetime
+import json
+import parse
+
+PLAN_VERSION = 1
+
+def build(template_domain, target_domain, group_suffix, skip_disabled, matched_users, matched_groups, sids, failed=()):
+    # Every SID seen in the export is covered by the plan, either as a pair or as deliberately unmapped.
+    # failed holds SIDs left unpaired only because a lookup failed, they stay uncovered so they are retried.
+    paired_sids = {sid: target for sid, target in parse.make_sid_pairs(matched_users, matched_groups).items() if target}
+    return {
+        'version': PLAN_VERSION,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'template_domain': template_domain,
+        'target_domain': target_domain,
+        'group_suffix': group_suffix,
+        'skip_disabled': skip_disabled,
+        'sid_pairs': paired_sids,
+        'users': {user[0]:[user[2], user[7]] for user in matched_users if user[8]},
+        'groups': {group[0]:[group[2], group[5]] for group in matched_groups},
+        'unmapped': sorted(sid for sid in sids if sid not in paired_sids and sid not in failed),
+    }
+
+def merge(mapping_plan, new_plan):
+    for key in ('sid_pairs', 'users', 'groups'):
+        mapping_plan[key].update(new_plan[key])
+    mapping_plan['unmapped'] = sorted((set(mapping_plan['unmapped']) | set(new_plan['unmapped'])) - set(mapping_plan['sid_pairs']))
+    mapping_plan['created'] = new_plan['created']
+    return mapping_plan
+
+def uncovered(mapping_plan, sids):
+    # sids is the Counter of SID occurrences from discovery, the counts are kept
+    covered = set(mapping_plan['sid_pairs']) | set(mapping_plan['unmapped'])
+    return collections.Counter({sid: count for sid, count in sids.items() if sid not in covered})
+
+def save(mapping_plan, file_name):
+    with open(file_name, 'w', encoding='utf-8') as plan_file:
+        json.dump(mapping_plan, plan_file, indent=2)
+    print(f'Mapping plan saved to {file_name}')
+
+def load(file_name):
+    with open(file_name, 'r', encoding='utf-8') as plan_file:
+        mapping_plan = json.load(plan_file)
+    if mapping_plan.get('version') != PLAN_VERSION:
+        raise ValueError(f'{file_name} is a version {mapping_plan.get("version")} mapping plan, expected version {PLAN_VERSION}')
+    return mapping_plan
@@ -0,0 +1,147 @@
+"""
+Module: resolve.py
+Description: Resolves SIDs and account names concurrently through a pluggable backend
+
+Author: Andrew Collings
+Created: 2026-10-18
+Updated: 2026-10-18
+License: MIT
+"""
+
+import concurrent.futures
+import time
+import instrument
+
+RESOLVE_WORKERS = 16
+BATCH_SIZE = 64
+RETRIES = 3
+BACKOFF = 0.5
+
+class Resolver:
+    # Backends return (name, domain, type) for a SID and a string SID for an account name,
+    # or None when the directory has no such account. Any exception is treated as transient.
+    # The batch lookups return an item's exception in place of its result once its retries run out.
+    def lookup_sid(self, sid):
+        raise NotImplementedError
+
+    def lookup_name(self, name):
+        raise NotImplementedError
+
+    def lookup_sids(self, sids):
+        return lookup_each(self.lookup_sid, sids)
+
+    def lookup_names(self, names):
+        return lookup_each(self.lookup_name, names)
+
+    def binary_sid(self, sid):
+        return sid
+
+class FakeResolver(Resolver):
+    # In-memory backend for running the pipeline without a domain controller
+    def __init__(self, accounts):
+        self.accounts = dict(accounts)
+        self.names = {}
+        for sid, (name, domain, account_type) in self.accounts.items():
+            self.names.setdefault(name, sid)
+            self.names[f'{domain}\\{name}'] = sid
+
+    def lookup_sid(self, sid):
+        return self.accounts.get(sid)
+
+    def lookup_name(self, name):
+        return self.names.get(name)
+
+class TimedResolver(Resolver):
+    # Times every lookup that reaches the wrapped resolver as one DC round trip
+    def __init__(self, resolver, kind='lookup'):
+        self.resolver = resolver
+        self.kind = kind
+
+    def lookup_sid(self, sid):
+        with instrument.dc_timer(f'{self.kind}_sid'):
+            return self.resolver.lookup_sid(sid)
+
+    def lookup_name(self, name):
+        with instrument.dc_timer(f'{self.kind}_name'):
+            return self.resolver.lookup_name(name)
+
+    def binary_sid(self, sid):
+        return self.resolver.binary_sid(sid)
+
+def with_retry(lookup, batch, retries, backoff):
+    for attempt in range(retries + 1):
+        try:
+            return lookup(batch)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+def lookup_each(lookup, items, retries=RETRIES, backoff=BACKOFF):
+    # Without a bulk call each item is its own round trip, so it is retried on its own and
+    # an item that keeps failing does not take the rest of its batch with it
+    results = []
+    for item in items:
+        try:
+            results.append(with_retry(lookup, item, retries, backoff))
+        except Exception as e:
+            results.append(e)
+    return results
+
+def batch_results(lookup, batch, results):
+    # Pairs each item of a finished batch with its result. A batch that failed as a whole is looked
+    # up again one item at a time, and items that still fail are reported and keep their exception.
+    if isinstance(results, Exception):
+        results = lookup_each(lookup, batch)
+    for item, result in zip(batch, results):
+        if isinstance(result, Exception):
+            print(f'Error looking up {item}, it will be treated as unresolved: {result}')
+        yield item, result
+
+def run_batches(lookup, items, workers=RESOLVE_WORKERS, batch_size=BATCH_SIZE, retries=RETRIES, backoff=BACKOFF):
+    # Yields (batch, results or the exception that exhausted the retries) as batches finish
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = {executor.submit(with_retry, lookup, batch, retries, backoff): batch for batch in batches}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+def resolve_sids(sids, resolver):
+    # Unresolved SIDs get False when the directory has no such account and None when the lookup
+    # failed, so a failure can be told apart and looked up again by a later run
+    print("Resolve SIDs to accounts")
+    accounts = {}
+    for batch, results in run_batches(resolver.lookup_sids, list(sids)):
+        accounts.update(batch_results(resolver.lookup_sid, batch, results))
+        instrument.advance(len(batch))
+    resolved_sids = []
+    for sid in sids:
+        user_line = [sid, resolver.binary_sid(sid)]
+        if isinstance(accounts[sid], Exception):
+            user_line.append(None)
+        elif not accounts[sid]:
+            user_line.append(False)
+        else:
+            user_line.extend(accounts[sid])
+        resolved_sids.append(user_line)
+    return resolved_sids
+
+def get_user_sid(matched_users, resolver):
+    # Appends the target SID to each user, False if there is no such account and None if the lookup failed
+    names = [user[7] for user in matched_users]
+    user_sids = {}
+    for batch, results in run_batches(resolver.lookup_names, names):
+        user_sids.update(batch_results(resolver.lookup_name, batch, results))
+        instrument.advance(len(batch))
+    for user in matched_users:
+        user_sid = user_sids[user[7]]
+        if isinstance(user_sid, Exception):
+            user_sid = None
+        elif not user_sid:
+            print(f'Could not find the SID for {user[7]}, no permissions will be created for it')
+            user_sid = False
+        user.append(user_sid)
+    return matched_users
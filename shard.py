@@ -0,0 +1,68 @@
+"""
+Module: shard.py
+Description: Splits the restore output into shards along directory subtrees for parallel icacls restores
+
+Author: Andrew Collings
+Created: 2026-10-18
+Updated: 2026-10-18
+License: MIT
+"""
+
+import codecs
+import collections
+import json
+import os
+import shutil
+import tempfile
+import zlib
+
+HEAD = -1
+
+def shard_of(path, shards, depth):
+    # Paths above the subtree roots go to the head shard because restoring them propagates
+    # inheritance into every subtree. Everything else follows its subtree root.
+    components = path.split('\\')
+    if len(components) < depth:
+        return HEAD
+    return zlib.crc32('\\'.join(components[:depth]).lower().encode('utf-16-le')) % shards
+
+def write_parts(records, shard_dir, shards, depth):
+    # Runs in the rewrite workers. records are (path, restore text) pairs in export order,
+    # each part is encoded in one go and written as bytes.
+    groups = collections.defaultdict(list)
+    for path, text in records:
+        groups[shard_of(path, shards, depth)].append(text)
+    parts = []
+    for index, texts in groups.items():
+        part_fd, part = tempfile.mkstemp(suffix='.part', dir=shard_dir)
+        with open(part_fd, 'wb') as part_file:
+            part_file.write(''.join(texts).encode('utf-16-le'))
+        parts.append((index, part, len(texts)))
+    return parts
+
+def write_shards(results, file_name, depth):
+    # Appends each shard's parts in export order so a directory always comes before its contents
+    parts = collections.defaultdict(list)
+    for chunk_parts in results:
+        for index, part, count in chunk_parts:
+            parts[index].append((part, count))
+    base, ext = os.path.splitext(file_name)
+    manifest = {'depth': depth, 'head': None, 'shards': []}
+    for index in sorted(parts):
+        shard_file = f'{base}.head{ext}' if index == HEAD else f'{base}.{index:03d}{ext}'
+        with open(shard_file, 'wb') as new_acl_file:
+            new_acl_file.write(codecs.BOM_UTF16_LE)
+            for part, count in parts[index]:
+                with open(part, 'rb') as part_file:
+                    shutil.copyfileobj(part_file, new_acl_file, 1 << 20)
+                os.remove(part)
+        entry = {'file': shard_file, 'records': sum(count for part, count in parts[index]), 'bytes': os.path.getsize(shard_file)}
+        if index == HEAD:
+            manifest['head'] = entry
+        else:
+            manifest['shards'].append(entry)
+    manifest_file = f'{base}.manifest.json'
+    with open(manifest_file, 'w', encoding='utf-8') as manifest_json:
+        json.dump(manifest, manifest_json, indent=2)
+    print(f'Wrote {len(manifest["shards"])} shards, manifest is {manifest_file}')
+    return manifest
@@ -1,88 +1,64 @@
 """
 Module: w32.py
-Description: Uses Win32 API to resolve/get SIDs and get users
+Description: Uses Win32 API to resolve SIDs and account names
 
 Author: Andrew Collings
 Created: 2025-02-08
-Updated: 2025-02-11
+Updated: 2026-10-18
 License: MIT
 """
 
-import win32api, win32security, win32net, win32netcon
+import win32api, win32security, win32netcon, pywintypes
 import sys
 import questionary
+import resolve
 
 computer_name = win32api.GetComputerName()
 
-def resolve_sids(sids):
-    print("Resolve SIDs to accounts")
-    resolved_sids = []
-    for sid in sids:
-        bin_sid = win32security.GetBinarySid(sid)
-        try:
-            account = win32security.LookupAccountSid(computer_name, bin_sid)
-        except:
-            account = False
-        user_line = [sid, bin_sid]
-        if not account:
-            user_line.append(account)
-        else:
-            user_line.extend(account)
-        resolved_sids.append(user_line)
-    return resolved_sids
+# ERROR_NONE_MAPPED and ERROR_INVALID_SID mean the account does not exist, anything else is retried
+NOT_MAPPED = (1332, 1337)
+
+class Win32Resolver(resolve.Resolver):
+    def __init__(self, system_name=computer_name):
+        self.system_name = system_name
 
-def get_users(level, server):
-    resume = 0
-    users = []
-    while True:
+    def lookup_sid(self, sid):
         try:
-            user_list, total, resume = win32net.NetUserEnum(server, level, win32netcon.FILTER_NORMAL_ACCOUNT, resume)
-            users.extend(user_list)
-            if resume == 0:
-                break
-        except Exception as e:
-            print(f"Error fetching user list: {e}")
-            break
-    return users
+            return win32security.LookupAccountSid(self.system_name, win32security.GetBinarySid(sid))
+        except pywintypes.error as e:
+            if e.winerror in NOT_MAPPED:
+                return None
+            raise
 
-def get_groups(level, server):
-    resume = 0
-    groups = []
-    while True:
+    def lookup_name(self, name):
         try:
-            group_list, total, resume = win32net.NetGroupEnum(server, level, resume)
-            groups.extend(group_list)
-            if resume == 0:
-                break
-        except Exception as e:
-            print(f"Error fetching user list: {e}")
-            break
-    return groups
+            sid_object = win32security.LookupAccountName(self.system_name, name)
+        except pywintypes.error as e:
+            if e.winerror in NOT_MAPPED:
+                return None
+            raise
+        return win32security.ConvertSidToStringSid(sid_object[0])
 
-def get_domain_users(dc_fqdns):
-    print("Enumerate all users")
-    domain_users = {}
-    user_level = 2
-    for domain, fqdn in dc_fqdns.items():
-        users = get_users(user_level, fqdn[0])
-        domain_users.update({domain:users})
-    return domain_users
+    def binary_sid(self, sid):
+        return win32security.GetBinarySid(sid)
+
+def resolve_sids(sids, resolver=None):
+    return resolve.resolve_sids(sids, resolver or Win32Resolver())
 
 def skip_disabled(filtered_users, domain_users, template_domain):
     active_users = []
     disabled_users = []
+    template_users = {}
+    for j in domain_users[template_domain]:
+        template_users.setdefault(j['name'], j)
     for i in range(len(filtered_users)):
-        for j in domain_users[template_domain]:
-            if j['name'] == filtered_users[i][2]:
-                if not bool(j['flags'] & win32netcon.UF_ACCOUNTDISABLE):
-                    active_users.append(filtered_users[i])
-                    break
-                if bool(j['flags'] & win32netcon.UF_ACCOUNTDISABLE):
-                    disabled_users.append(filtered_users[i])
-                    break
-                else:
-                    print(f'Error determining if user {j['full_name']} ({j['name']}) is disabled. Exiting...')
-                    sys.exit()
+        j = template_users.get(filtered_users[i][2])
+        if j is None:
+            continue
+        if bool(j['flags'] & win32netcon.UF_ACCOUNTDISABLE):
+            disabled_users.append(filtered_users[i])
+        else:
+            active_users.append(filtered_users[i])
     print("The following users are disabled and will not be mapped to users in the target domain:")
     for i in range(len(disabled_users)):
         print(f'{disabled_users[i][2]}', end='   ')
@@ -94,8 +70,5 @@ def skip_disabled(filtered_users, domain_users, template_domain):
     else:
         return active_users, disabled_users
 
-def get_user_sid(matched_users):
-    for i in range(len(matched_users)):
-        sid_object = win32security.LookupAccountName(computer_name, matched_users[i][7])
-        matched_users[i].append(win32security.ConvertSidToStringSid(sid_object[0]))
-    return matched_users
\ No newline at end of file
+def get_user_sid(matched_users, resolver=None):
+    return resolve.get_user_sid(matched_users, resolver or Win32Resolver())
\ No newline at end of file